@@ -29,30 +29,33 @@ class HuaweiE220SIMClass(HuaweiSIMClass):
     
     def initialize(self):
         d = super(HuaweiE220SIMClass, self).initialize(set_encoding=False)
-        def initialize_cb(size):
-            self.sconn.get_smsc()
-            # before switching to UCS2, we need to get once the SMSC number
-            # otherwise as soon as we send a SMS, the device would reset
-            # as if it had been unplugged and replugged to the system
-            def process_charset(charset):
-                """
-                Do not set charset to UCS2 if is not necessary, returns size
-                """
-                if charset == "UCS2":
-                    self.set_charset(charset)
-                    return size
-                else:
-                    d = self.sconn.set_charset("UCS2")
-                    d.addCallback(lambda ignored: size)
-                    return d
-            
-            d2 = self.sconn.get_charset()
-            d2.addCallback(process_charset)
-            return d2
+        d.addCallback(self._initialize_cb)
+        return d
 
-        d.addCallback(initialize_cb)
+    def _initialize_cb(self, size):
+        self.sconn.get_smsc()
+        # before switching to UCS2, we need to get once the SMSC number
+        # otherwise as soon as we send a SMS, the device would reset
+        # as if it had been unplugged and replugged to the system
+        d = self.sconn.get_charset()
+        d.addCallback(self._process_charset, size)
         return d
 
+    def _process_charset(self, charset, size):
+        """
+        Do not set charset to UCS2 if is not necessary, returns size
+        """
+        if charset == "UCS2":
+            self.set_charset(charset)
+            return size
+
+        d = self.sconn.set_charset("UCS2")
+        d.addCallback(self._return_size, size)
+        return d
+
+    def _return_size(self, ignored, size):
+        return size
+
 
 class HuaweiE220(HuaweiDBusDevicePlugin):
     """L{vmc.common.plugin.DBusDevicePlugin} for Huawei's E220"""
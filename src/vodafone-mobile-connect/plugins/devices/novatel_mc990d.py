@@ -19,8 +19,9 @@
 Plugin for Novatel Ovation MC990D
 """
 
-from vmc.common.hardware.novatel import NovatelCustomizer, NovatelDBusDevicePlugin
-import serial
+from vmc.common.hardware.novatel import (NovatelCustomizer,
+                                         NovatelDBusDevicePlugin,
+                                         novatel_flip_to_at_mode)
 
 class NovatelMC990D(NovatelDBusDevicePlugin):
     """L{vmc.common.plugin.DBusDevicePlugin} for Novatel's MC990D"""
@@ -41,8 +42,6 @@ class NovatelMC990D(NovatelDBusDevicePlugin):
         # before it will answer our AT queries. So the primary port
         # needs this string first or auto detection of ctrl port fails.
         # Note: Early models/firmware were DM only
-        ser = serial.Serial(ports[0], timeout=1)
-        ser.write('AT$NWDMAT=1\r\n')
-        ser.close()
+        novatel_flip_to_at_mode(ports[0])
 
 
@@ -18,8 +18,9 @@
 
 __version__ = "$Rev: 1172 $"
 
-from vmc.common.hardware.novatel import NovatelCustomizer, NovatelDBusDevicePlugin
-import serial
+from vmc.common.hardware.novatel import (NovatelCustomizer,
+                                         NovatelDBusDevicePlugin,
+                                         novatel_flip_to_at_mode)
 
 class NovatelMiFi2352(NovatelDBusDevicePlugin):
     """L{vmc.common.plugin.DBusDevicePlugin} for Novatel's MiFi 2352"""
@@ -44,9 +45,7 @@ class NovatelMiFi2352(NovatelDBusDevicePlugin):
         # before it will answer our AT queries. So the primary port
         # needs this string first or auto detection of ctrl port fails.
         # Note: Early models/firmware were DM only
-        ser = serial.Serial(ports[0], timeout=1)
-        ser.write('AT$NWDMAT=1\r\n')
-        ser.close()
+        novatel_flip_to_at_mode(ports[0])
 
 
 novatelmifi2352 = NovatelMiFi2352()
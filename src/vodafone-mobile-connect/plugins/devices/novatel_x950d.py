@@ -17,8 +17,9 @@
 
 __version__ = "$Rev: 1172 $"
 
-import serial
-from vmc.common.hardware.novatel import NovatelCustomizer, NovatelDBusDevicePlugin
+from vmc.common.hardware.novatel import (NovatelCustomizer,
+                                         NovatelDBusDevicePlugin,
+                                         novatel_flip_to_at_mode)
 
 class NovatelX950D(NovatelDBusDevicePlugin):
     """L{vmc.common.plugin.DBusDevicePlugin} for Novatel's X950D"""
@@ -39,8 +40,6 @@ class NovatelX950D(NovatelDBusDevicePlugin):
         # before it will answer our AT queries. So the primary port
         # needs this string first or auto detection of ctrl port fails.
         # Note: Early models/firmware were DM only
-        ser = serial.Serial(ports[0], timeout=1)
-        ser.write('AT$NWDMAT=1\r\n')
-        ser.close()
+        novatel_flip_to_at_mode(ports[0])
 
 novatelx950d = NovatelX950D()
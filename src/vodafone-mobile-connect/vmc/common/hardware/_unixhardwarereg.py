@@ -116,6 +116,8 @@ class HardwareRegistry(DbusComponent):
         self.devices = {}
         self.added_udis = []
         self.call_id = None
+        # snapshot of HAL's device properties while building devices
+        self._props_cache = None
 
         self.connect_to_dbus_signals()
         # prepopulate device list
@@ -181,19 +183,35 @@ class HardwareRegistry(DbusComponent):
         """
         Returns a list of devices built out of the info extracted from C{udis}
         """
-        unknown_devs = map(self._get_device_from_udi, udis)
+        # every device in this batch is built out of the same snapshot of
+        # the device tree, rather than walking HAL over DBus for each one
+        self._props_cache = self.get_devices_properties()
+        try:
+            unknown_devs = map(self._get_device_from_udi, udis)
+        finally:
+            self._props_cache = None
+
         deferreds = map(identify_device, unknown_devs)
         return defer.gatherResults(deferreds)
 
+    def _get_properties(self, udi):
+        """
+        Returns the properties of C{udi}, from the current snapshot if any
+        """
+        if self._props_cache is not None and udi in self._props_cache:
+            return self._props_cache[udi]
+
+        return self.get_properties_from_udi(udi)
+
     def _same_pcmcia_slot(self, u1, u2):
         """
         Returns true if the devices are present on the same PCMCIA card
         """
-        p1 = self.get_properties_from_udi(u1)
+        p1 = self._get_properties(u1)
         if not 'pcmcia.socket_number' in p1:
             return False
 
-        p2 = self.get_properties_from_udi(u2)
+        p2 = self._get_properties(u2)
         if not 'pcmcia.socket_number' in p2:
             return False
 
@@ -305,13 +323,15 @@ class HardwareRegistry(DbusComponent):
         return last_udi
 
     def _get_info_from_udi(self, udi):
-        return extract_info(self.get_properties_from_udi(udi))
+        return extract_info(self._get_properties(udi))
 
     def _get_child_udis_from_udi(self, udi):
         """
         Returns the paths of C{udi} childs and the properties used
         """
-        device_props = self.get_devices_properties()
+        device_props = self._props_cache
+        if device_props is None:
+            device_props = self.get_devices_properties()
         dev_udis = sorted(device_props.keys(), key=len)
 
         # Given the matched udi, we search through the device tree
@@ -327,20 +347,25 @@ class HardwareRegistry(DbusComponent):
 
         # We now search all udis looking for any decendants of our
         # matched udi, or maybe its pcmcia sibling
-        childs = []
+        childs = set()
         for cur_udi in udi_list:             # maybe pcmcia siblings
             for i in range(2):               # look for children & grandchilren
-                dev_udis2 = dev_udis[:]
-                while dev_udis2:
-                    _udi = dev_udis2.pop()
-                    if _udi != cur_udi and 'info.parent' in device_props[_udi]:
-                        par_udi = device_props[_udi]['info.parent']
+                found = False
+                for _udi in reversed(dev_udis):
+                    if _udi == cur_udi or _udi in childs:
+                        continue
+
+                    par_udi = device_props[_udi].get('info.parent')
+                    if par_udi is not None and (par_udi == cur_udi or
+                                                par_udi in childs):
+                        childs.add(_udi)
+                        found = True
 
-                        if par_udi == cur_udi or (par_udi in childs and
-                                                    _udi not in childs):
-                            childs.append(_udi)
+                if not found:
+                    # nothing new hangs from cur_udi, another pass is useless
+                    break
 
-        childs = list(set(childs)) # make unique 
+        childs = list(childs)
 
         return childs, device_props
 
@@ -352,8 +377,9 @@ class HardwareRegistry(DbusComponent):
         if not childs:
             raise RuntimeError("Couldn't find any child of device %s" % udi)
 
-        ports = map(str, [dp[_udi]['serial.device']
-                        for _udi in childs if 'serial.device' in dp[_udi]])
+        # HAL hands us dbus.String, serial wants plain str
+        ports = [str(dp[_udi]['serial.device'])
+                    for _udi in childs if 'serial.device' in dp[_udi]]
         natsort(ports)
         return ports
 
@@ -361,8 +387,9 @@ class HardwareRegistry(DbusComponent):
         """
         Returns a C{DevicePlugin} out of C{info} and C{dport} and {cport}
         """
-        from vmc.common.plugin import PluginManager
-        plugin = PluginManager.get_plugin_by_vendor_product_id(*info.values())
+        from vmc.common.plugin import PluginManager, get_vendor_product_id
+        plugin = PluginManager.get_plugin_by_vendor_product_id(
+                                            *get_vendor_product_id(info))
 
         if plugin:
             # set its udi
@@ -370,7 +397,8 @@ class HardwareRegistry(DbusComponent):
 
             if hasattr(plugin, 'preprobe_init'):
                 # this plugin requires special initialisation before probing
-                plugin.preprobe_init(ports, extract_info(info))
+                # info already went through extract_info in _get_info_from_udi
+                plugin.preprobe_init(ports, info)
 
             if hasattr(plugin, 'hardcoded_ports'):
                 # this plugin registers its ports in a funky way and thus
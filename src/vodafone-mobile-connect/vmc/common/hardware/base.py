@@ -20,8 +20,6 @@ Base classes for the hardware module
 """
 __version__ = "$Rev: 1172 $"
 
-import serial
-
 from twisted.internet.threads import deferToThread
 from twisted.python import log
 
@@ -62,10 +60,37 @@ class Customizer(object):
     netrklass = NetworkRegStateMachine
 
 
+# from linux/serial.h
+TIOCGSERIAL = 0x541E
+TIOCSSERIAL = 0x541F
+ASYNC_LOW_LATENCY = 0x2000
+
+def set_low_latency(fd):
+    """
+    Sets the ASYNC_LOW_LATENCY flag on the serial port behind C{fd}
+
+    USB serial drivers will then push received data as soon as it arrives
+    rather than waiting for their latency timer to expire. Not every driver
+    supports it, so failures are just logged
+    """
+    import array
+    import fcntl
+
+    # struct serial_struct, flags is its fifth int
+    buf = array.array('i', [0] * 32)
+    try:
+        fcntl.ioctl(fd, TIOCGSERIAL, buf, True)
+        buf[4] |= ASYNC_LOW_LATENCY
+        fcntl.ioctl(fd, TIOCSSERIAL, buf)
+    except IOError, e:
+        log.msg("Couldn't set low latency mode: %s" % e)
+
 def _identify_device(port):
     """
     Returns the model of the device present at C{port}
     """
+    import serial
+
     # as the readlines method blocks, this is executed in a parallel thread
     # with deferToThread
     ser = serial.Serial(port, timeout=1)
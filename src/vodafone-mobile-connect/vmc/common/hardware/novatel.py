@@ -21,7 +21,7 @@ Common stuff for all Novatel's cards
 
 __version__ = "$Rev: 1172 $"
 
-from vmc.common.hardware.base import Customizer
+from vmc.common.hardware.base import Customizer, set_low_latency
 from vmc.common.sim import SIMBaseClass
 from vmc.common.plugin import DBusDevicePlugin
 
@@ -35,7 +35,23 @@ NOVATEL_DICT = {
    'GPRSPREF' : None,
    '3GPREF'   : 'AT$NWRAT=0,2',
 }
-    
+
+def novatel_flip_to_at_mode(port):
+    """
+    Flips the secondary port from DM to AT mode by writing to C{port}
+    """
+    import serial
+
+    # we never read from the port, just make sure the write can't hang
+    ser = serial.Serial(port, timeout=0, writeTimeout=0.5)
+    # the probe that follows will talk to this port too
+    set_low_latency(ser.fd)
+    ser.write('AT$NWDMAT=1\r\n')
+    # wait for the command to reach the device before closing
+    ser.flush()
+    ser.close()
+
+
 class NovatelSIMClass(SIMBaseClass):
     """
     Novatel SIM Class
@@ -16,18 +16,28 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import os
+from bisect import bisect_right
+
 from zope.interface import implements
-from os.path import join
+from twisted.internet.threads import deferToThread
+from os.path import join, expanduser
 
 from vmc.common.consts import IMAGES_DIR
 from vmc.common.interfaces import IContact
 
+_KABC_PATH = expanduser('~/.kde/share/apps/kabc/std.vcf')
+_EDITOR = ('kaddressbook',)
+
 class KDEContact(object):
     """
     I represent a contact in Evolution
     """
     implements(IContact)
     typeName = 'KDEContact'
+    __slots__ = ('name', 'number', 'index', 'writable')
+    image_16x16_path = join(IMAGES_DIR, 'kdepim.png')
+    _REPR = '<KDEContact name=%r number=%r>'
 
     def __init__(self, name, number, index=None):
         self.name = name
@@ -36,13 +46,13 @@ class KDEContact(object):
         self.writable = False
 
     def __repr__(self):
-        return '<KDEContact name="%s" number="%s">' % (self.name, self.number)
+        return self._REPR % (self.name, self.number)
 
     def __eq__(self, c):
         return self.name == c.name and self.number == c.number
 
     def __ne__(self, c):
-        return not (self.name == c.name and self.number == c.number)
+        return not self.__eq__(c)
 
     def get_index(self):
         return self.index
@@ -57,31 +67,76 @@ class KDEContact(object):
         return self.writable
 
     def external_editor(self):
-        return ['kaddressbook', ]
+        return _EDITOR
 
     def image_16x16(self):
-        return join(IMAGES_DIR, 'kdepim.png')
+        return self.image_16x16_path
 
     def to_csv(self):
         """Returns a list with the name and number formatted for csv"""
-        name = '"' + self.name + '"'
-        number = '"' + self.number + '"'
-        return [name, number]
+        return ['"%s"' % self.name, '"%s"' % self.number]
 
 
 class KDEContactsManager(object):
     """
     Contacts manager
     """
+    def __init__(self):
+        # (mtime, contacts, names_buf, offsets) from the last parse of the
+        # address book. It is built in a worker thread and read from the
+        # reactor thread, so it is only ever replaced as a whole
+        self._snapshot = None
+
     def find_contacts(self, pattern):
-        for contact in self.get_contacts():
-            # XXX: O(N) here!
-            # I can't find a way to do a LIKE comparison
-            if pattern.lower() in contact.get_name().lower():
-                yield contact
+        """
+        Returns a deferred that will be called with the matching contacts
+
+        The vCard file is parsed in a thread so the reactor is not blocked
+        """
+        d = deferToThread(self._load)
+        d.addCallback(self._find_contacts, pattern)
+        return d
+
+    def _find_contacts(self, snapshot, pattern):
+        mtime, contacts, buf, offsets = snapshot
+        pattern = pattern.lower()
+        if not contacts or '\n' in pattern:
+            return []
+
+        # all the lowercased names are joined in a single buffer, so we
+        # let str.find do the scanning instead of testing every name
+        ret = []
+        start = buf.find(pattern)
+        while start != -1:
+            i = bisect_right(offsets, start) - 1
+            ret.append(contacts[i])
+            if i + 1 == len(offsets):
+                break
+            start = buf.find(pattern, offsets[i + 1])
+
+        return ret
+
+    def get_contacts_async(self):
+        """Returns a deferred that will be called with all the contacts"""
+        return deferToThread(self.get_contacts)
 
     def get_contacts(self):
-        from os.path import expanduser
+        return self._load()[1]
+
+    def _load(self):
+        """
+        Returns the (mtime, contacts, names_buf, offsets) snapshot of the
+        address book, parsing it again only if it changed since last time
+        """
+        try:
+            mtime = os.stat(_KABC_PATH).st_mtime
+        except OSError:
+            self._snapshot = None
+            return (None, [], '', [])
+
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == mtime:
+            return snapshot
 
         # XXX: maybe we should try to read a system version of the
         #      vcard library provided with pycocuma
@@ -90,23 +145,31 @@ class KDEContactsManager(object):
         vl = vCardList()
 
         ret = []
-        if vl.LoadFromFile(expanduser('~') + '/.kde/share/apps/kabc/std.vcf'):
-            for vc in vl.data.keys():
+        if vl.LoadFromFile(_KABC_PATH):
+            for card in vl.data.itervalues():
 
-                fn = vl.data[vc].fn.get()
+                fn = card.fn.get()
 
-                if len(fn):
-                    tel = vl.data[vc].tel
+                if fn:
                     cell = ''
-                    for num in tel:
-                        if 'CELL' in num.params.get('type'):
+                    for num in card.tel:
+                        if 'CELL' in (num.params.get('type') or ()):
                             cell = num.value.get()
                             break
 
-                    email = vl.data[vc].email
-                    if len(cell) or len(email):  # try to exclude distribution lists etc
+                    if cell or card.email:  # try to exclude distribution lists etc
                         ret.append(KDEContact(name=fn, number=cell))
-        return ret
+
+        lower_names = [c.name.lower() for c in ret]
+        offsets = []
+        offset = 0
+        for name in lower_names:
+            offsets.append(offset)
+            offset += len(name) + 1
+
+        snapshot = (mtime, ret, '\n'.join(lower_names), offsets)
+        self._snapshot = snapshot
+        return snapshot
 
     def get_contact_by_id(self, index):
         print "KDEContactsManager::get_contact_by_id called"
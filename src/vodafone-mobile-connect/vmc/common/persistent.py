@@ -281,7 +281,7 @@ class NetworkOperatorManager(AxiomDBManager):
 
     def get_network_by_id(self, netid):
         # XXX: O(N) here!
-        for network in self.store.query(DBNetworkOperator):
+        for network in self.store.query(DBNetworkOperator).iterate():
             for n in network.netid:
                 if str(netid).startswith(n):
                     return network
@@ -116,7 +116,7 @@ class PhoneBook(object):
         return list(self.evlcmanager.find_contacts(pattern))
 
     def _find_contact_in_kde(self, pattern):
-        return list(self.kdecmanager.find_contacts(pattern))
+        return self.kdecmanager.find_contacts(pattern)
 
     def find_contact(self, name=None, number=None):
         if (not name and not number) or (name and number):
@@ -129,13 +129,17 @@ class PhoneBook(object):
             def find_contacts_ev(contacts):
                 return self._find_contact_in_ev(name) + contacts
             def find_contacts_kde(contacts):
-                return self._find_contact_in_kde(name) + contacts
+                d2 = self._find_contact_in_kde(name)
+                d2.addCallback(lambda kdec: kdec + contacts)
+                return d2
 
             def find_contacts_eb(failure):
                 failure.trap(ex.ATError, ex.CMEErrorNotFound)
-                return ( self._find_contact_in_db(name) +
-                         self._find_contact_in_ev(name) +
-                         self._find_contact_in_kde(name) )
+                contacts = ( self._find_contact_in_db(name) +
+                             self._find_contact_in_ev(name) )
+                d2 = self._find_contact_in_kde(name)
+                d2.addCallback(lambda kdec: contacts + kdec)
+                return d2
 
             d.addCallback(find_contacts_db)
             d.addCallback(find_contacts_ev)
@@ -155,10 +159,15 @@ class PhoneBook(object):
             return d
 
     def get_contacts(self):
+        def get_kde_contacts(prec):
+            d2 = self.kdecmanager.get_contacts_async()
+            d2.addCallback(lambda kdec: list(kdec) + prec)
+            return d2
+
         d = self.sconn.get_contacts()
         d.addCallback(lambda simc: list(self.cmanager.get_contacts()) + simc)
         d.addCallback(lambda prec: list(self.evlcmanager.get_contacts()) + prec)
-        d.addCallback(lambda prec: list(self.kdecmanager.get_contacts()) + prec)
+        d.addCallback(get_kde_contacts)
         d.addErrback(log.err)
         return d
 
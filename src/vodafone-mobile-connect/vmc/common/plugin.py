@@ -79,17 +79,22 @@ TEMPLATES_DICT = {
     'CHAP' : CHAP_TEMPLATE,
 }
 
-def flatten_list(x):
+# (vendor, product) keys used in __properties__ for every supported bus
+ID_KEYS = [
+    ('usb_device.vendor_id', 'usb_device.product_id'),
+    ('pcmcia.manf_id', 'pcmcia.card_id'),
+    ('pci.vendor_id', 'pci.product_id'),
+]
+
+def get_vendor_product_id(info):
     """
-    Flattens C{x} into a single list
+    Returns a (vendor_id, product_id) tuple out of the device C{info}
     """
-    result = []
-    for el in x:
-        if hasattr(el, "__iter__") and not isinstance(el, basestring):
-            result.extend(flatten_list(el))
-        else:
-            result.append(el)
-    return result
+    for vendor_key, product_key in ID_KEYS:
+        if vendor_key in info:
+            return int(info[vendor_key]), int(info[product_key])
+
+    raise ValueError("No vendor and product id in %s" % info)
 
 
 class DevicePlugin(object):
@@ -163,6 +168,27 @@ class DBusDevicePlugin(DevicePlugin):
         self.udi = None
         self.parent_udi = None
         self.mapping = None
+        # (vendor_id, product_id) list, see get_vendor_product_ids
+        self._vendor_product_ids = None
+
+    def get_vendor_product_ids(self):
+        """
+        Returns a list with all the (vendor_id, product_id) that I support
+
+        It is computed the first time is requested, so later changes done
+        by C{preprobe_init} to C{__properties__} do not affect matching and
+        the index built by L{PluginManager} stays keyed on the declared ids
+        """
+        if self._vendor_product_ids is None:
+            ids = []
+            for vendor_key, product_key in ID_KEYS:
+                for vendor_id in self.__properties__.get(vendor_key, []):
+                    for product_id in self.__properties__.get(product_key, []):
+                        ids.append((vendor_id, product_id))
+
+            self._vendor_product_ids = ids
+
+        return self._vendor_product_ids
 
     def patch(self, other):
         super(DBusDevicePlugin, self).patch(other)
@@ -324,6 +350,8 @@ class NotificationPlugin(object):
 import vmc.common.plugins
 class PluginManager(object):
     """I manage VMCCdfL's plugins"""
+    # (vendor_id, product_id) -> DBusDevicePlugin
+    _vendor_product_index = None
     
     @classmethod
     def get_plugins(cls, interface=IPlugin, package=vmc.common.plugins):
@@ -333,6 +361,20 @@ class PluginManager(object):
     def regenerate_cache(cls):
         log.msg("PluginManager: Regenerating plugin cache...")
         list(getPlugins(IPlugin, package=vmc.common.plugins))
+        cls._vendor_product_index = None
+
+    @classmethod
+    def _get_vendor_product_index(cls):
+        if cls._vendor_product_index is None:
+            index = {}
+            for plugin in cls.get_plugins(interfaces.IDBusDevicePlugin):
+                for ids in plugin.get_vendor_product_ids():
+                    # first plugin found wins, as with the old linear scan
+                    index.setdefault(ids, plugin)
+
+            cls._vendor_product_index = index
+
+        return cls._vendor_product_index
 
     @classmethod
     def get_plugin_by_remote_name(cls, name,
@@ -360,20 +402,20 @@ class PluginManager(object):
         args = (vendor_id, product_id)
         print "get_plugin_by_vendor_product_id called with 0x%04X and 0x%04X" % args
 
-        for plugin in cls.get_plugins(interfaces.IDBusDevicePlugin):
-            props = flatten_list(plugin.__properties__.values())
-            if int(product_id) in props and int(vendor_id) in props:
-                if not plugin.mapping:
-                    # regular plugin
-                    return plugin
-
-                # device has multiple personalities...
-                # this will just return the default plugin for
-                # the mapping, we keep a reference to the mapping
-                # once the device is properly identified by
-                # vmc.common.hardware.base::identify_device
-                _plugin = plugin.mapping['default']()
-                _plugin.mapping = plugin.mapping
-                return _plugin
+        index = cls._get_vendor_product_index()
+        plugin = index.get((int(vendor_id), int(product_id)))
+        if plugin is None:
+            return None
 
-        return None
+        if not plugin.mapping:
+            # regular plugin
+            return plugin
+
+        # device has multiple personalities...
+        # this will just return the default plugin for
+        # the mapping, we keep a reference to the mapping
+        # once the device is properly identified by
+        # vmc.common.hardware.base::identify_device
+        _plugin = plugin.mapping['default']()
+        _plugin.mapping = plugin.mapping
+        return _plugin
@@ -26,6 +26,7 @@ __version__ = "$Rev: 1172 $"
 
 from twisted.python import log
 from twisted.internet import defer, reactor
+from twisted.internet.defer import deferredGenerator, waitForDeferred
 from time import time
 
 import vmc.common.exceptions as ex
@@ -37,6 +38,29 @@ REGISTER_TIMEOUT = 120
 REGISTER_INTERVAL = 8
 MAX_FAILURES = 3
 
+# Modal class -> whether any of its modes defines __enter__/__exit__
+_MODE_HOOKS = {}
+
+def has_mode_hooks(klass):
+    """
+    Returns True if a mode of C{klass} or of its bases defines hooks
+
+    Modal's own C{nil} mode is not taken into account
+    """
+    try:
+        return _MODE_HOOKS[klass]
+    except KeyError:
+        found = False
+        for base in klass.__mro__:
+            if base is Modal:
+                break
+            if '__enter__' in base.__dict__ or '__exit__' in base.__dict__:
+                found = True
+                break
+
+        _MODE_HOOKS[klass] = found
+        return found
+
 class NetworkRegStateMachine(StateMachineMixin, Modal):
     """
     I register with the network
@@ -66,6 +90,13 @@ class NetworkRegStateMachine(StateMachineMixin, Modal):
     def __repr__(self):
         return self.__class__.__name__
 
+    def transitionTo(self, stateName):
+        if has_mode_hooks(self.__class__):
+            Modal.transitionTo(self, stateName)
+        else:
+            # none of my modes has __enter__/__exit__ hooks, so just switch
+            self.mode = stateName
+
     def cancel_poll(self):
         if self.cID:
             self.cID.cancel()
@@ -198,30 +229,22 @@ class NetworkRegStateMachine(StateMachineMixin, Modal):
             self.transitionTo('registration_finished')
             self.do_next()
     
-    def _process_imsi_cb(self, imsi_prefix):
-        self.prefix = imsi_prefix
+    def _obtain_netinfo(self):
+        """
+        Find out whether we are registered with our home network or not
+        """
+        imsi = waitForDeferred(self.device.sconn.get_imsi())
+        yield imsi
+        self.prefix = int(imsi.getResult()[:5]) # FIXME IMSI 5 digit restriction
         self.device.sconn.set_network_info_format()
+
         # is it really necessary to register with the network?
-        def network_info_cb(netinfo):
-            netname, conn_type = netinfo
-            if isinstance(netname, int):
-                if netname == imsi_prefix:
-                    # we are already registered with our network
-                    self.transitionTo('registration_finished')
-                else:
-                    self.transitionTo('search_operators')
-            else:
-                assert isinstance(netname, str)
-                # we already setup AT+COPS=0,2 but the device insists in
-                # replying in alphanumeric format, we'll accept it for now
-                # this happens with Option's Nozomi at least
-                self.transitionTo('registration_finished')
-            
-            # transition to registration_finished or search_operators
-            self.do_next()
-        
-        def network_info_eb(failure):
-            failure.trap(ex.NetworkTemporalyUnavailableError)
+        netinfo = waitForDeferred(
+                        self.device.sconn.get_network_info(process=False))
+        yield netinfo
+        try:
+            netname, conn_type = netinfo.getResult()
+        except ex.NetworkTemporalyUnavailableError:
             self.num_failures += 1
             if self.num_failures >= MAX_FAILURES:
                 self.transitionTo('registration_failed')
@@ -229,11 +252,26 @@ class NetworkRegStateMachine(StateMachineMixin, Modal):
             else:
                 # repeat till we succeed
                 self.do_next()
-        
-        d = self.device.sconn.get_network_info(process=False)
-        d.addCallback(network_info_cb)
-        d.addErrback(network_info_eb)
-    
+            return
+
+        if isinstance(netname, int):
+            if netname == self.prefix:
+                # we are already registered with our network
+                self.transitionTo('registration_finished')
+            else:
+                self.transitionTo('search_operators')
+        else:
+            assert isinstance(netname, str)
+            # we already setup AT+COPS=0,2 but the device insists in
+            # replying in alphanumeric format, we'll accept it for now
+            # this happens with Option's Nozomi at least
+            self.transitionTo('registration_finished')
+
+        # transition to registration_finished or search_operators
+        self.do_next()
+
+    _obtain_netinfo = deferredGenerator(_obtain_netinfo)
+
     def get_net_names_cb(self, net_objs):
         names = [obj for obj in net_objs if obj.netid == self.prefix]
         try:
@@ -280,12 +318,6 @@ class NetworkRegStateMachine(StateMachineMixin, Modal):
         """
         Check if we are currently registered with the network
         """
-        def __enter__(self):
-            pass
-        
-        def __exit__(self):
-            pass
-        
         def do_next(self):
             log.msg("%s: NEW MODE: check_registered" % self)
             # calc the absolute timeout for the operation
@@ -301,12 +333,6 @@ class NetworkRegStateMachine(StateMachineMixin, Modal):
         """
         Wait till we are registered with the network, if after 
         """
-        def __enter__(self):
-            pass
-        
-        def __exit__(self):
-            pass
-        
         def do_next(self):
             log.msg("%s: NEW MODE: wait_to_register" % self)
             if not self.cID:
@@ -319,28 +345,14 @@ class NetworkRegStateMachine(StateMachineMixin, Modal):
         """
         Find out what network are we registered with
         """
-        def __enter__(self):
-            pass
-        
-        def __exit__(self):
-            pass
-        
         def do_next(self):
             log.msg("%s: NEW MODE: obtain_netinfo" % self)
-            d = self.device.sconn.get_imsi()
-            d.addCallback(lambda response: int(response[:5])) # FIXME IMSI 5 digit restriction
-            d.addCallback(self._process_imsi_cb)
+            self._obtain_netinfo()
     
     class search_operators(mode):
         """
         Find out what operators are around
         """
-        def __enter__(self):
-            pass
-        
-        def __exit__(self):
-            pass
-        
         def do_next(self):
             log.msg("%s: NEW MODE: search_operators" % self)
             d = self.device.sconn.get_network_names()
@@ -352,12 +364,6 @@ class NetworkRegStateMachine(StateMachineMixin, Modal):
         my CPOL list and if I can't find there an ID to register with, use
         the configuration system.
         """
-        def __enter__(self):
-            pass
-        
-        def __exit__(self):
-            pass
-        
         def do_next(self):
             log.msg("%s: NEW MODE: international_roaming" % self)
             d = self.device.sconn.get_roaming_ids()
@@ -367,12 +373,6 @@ class NetworkRegStateMachine(StateMachineMixin, Modal):
         """
         We've found the operator that we must register with
         """
-        def __enter__(self):
-            pass
-        
-        def __exit__(self):
-            pass
-        
         def do_next(self):
             log.msg("%s: NEW MODE: register_with_operator" % self)
             d = self.device.sconn.register_with_network(self.netobj.netid)
@@ -390,12 +390,6 @@ class NetworkRegStateMachine(StateMachineMixin, Modal):
         """
         Find out what network are we registered with
         """
-        def __enter__(self):
-            pass
-        
-        def __exit__(self):
-            pass
-        
         def do_next(self):
             log.msg("%s: NEW MODE: registration_finished" % self)
             # set encoding back to UCS2
@@ -407,12 +401,6 @@ class NetworkRegStateMachine(StateMachineMixin, Modal):
         """
         Registration failed, send
         """
-        def __enter__(self):
-            pass
-        
-        def __exit__(self):
-            pass
-        
         def do_next(self, _exception=None):
             log.msg("%s: NEW MODE: registration_failed" % self)
             # set encoding back to UCS2
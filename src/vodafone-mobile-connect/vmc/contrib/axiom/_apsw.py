@@ -15,6 +15,11 @@ import apsw
 from twisted.python import log
 
 from vmc.contrib.axiom import errors, iaxiom
+from vmc.contrib.axiom._stats import statsObserved
+
+# How many prepared statements APSW keeps around for reuse per connection;
+# see the PySQLite backend.
+CACHED_STATEMENTS = 256
 
 class Connection(object):
     def __init__(self, connection, timeout=None):
@@ -24,7 +29,9 @@ class Connection(object):
 
 
     def fromDatabaseName(cls, dbFilename, timeout=None):
-        return cls(apsw.Connection(dbfname), timeout)
+        return cls(apsw.Connection(dbFilename,
+                                   statementcachesize=CACHED_STATEMENTS),
+                   timeout)
     fromDatabaseName = classmethod(fromDatabaseName)
 
 
@@ -32,6 +39,14 @@ class Connection(object):
         return Cursor(self)
 
 
+    def totalChanges(self):
+        """
+        @return: the number of rows inserted, updated or deleted through this
+        connection since it was opened.
+        """
+        return self._connection.totalchanges()
+
+
     def _close(self):
         self._connection = None
 
@@ -56,14 +71,33 @@ class Cursor(object):
         return iter(self._cursor)
 
 
+    def fetchall(self):
+        """
+        Return a list of all the remaining result rows of the last statement.
+        """
+        return list(self._cursor)
+
+
     def execute(self, sql, args=()):
+        return self._execute(self._cursor.execute, sql, args)
+
+
+    def executemany(self, sql, argsList):
+        """
+        Execute a statement once for each of a sequence of argument lists.
+        """
+        return self._execute(self._cursor.executemany, sql, argsList)
+
+
+    def _execute(self, method, sql, args):
         try:
             t = time.time()
             try:
-                return self._cursor.execute(sql, args)
+                return method(sql, args)
             finally:
-                log.msg(interface=iaxiom.IStatEvent,
-                        stat_cursor_execute_time=time.time() - t)
+                if statsObserved():
+                    log.msg(interface=iaxiom.IStatEvent,
+                            stat_cursor_execute_time=time.time() - t)
         except apsw.Error, e:
             raise errors.SQLError(sql, args, e)
 
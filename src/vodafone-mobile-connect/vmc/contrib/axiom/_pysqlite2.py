@@ -16,6 +16,13 @@ except ImportError:
 from twisted.python import log
 
 from vmc.contrib.axiom import errors, iaxiom
+from vmc.contrib.axiom._stats import statsObserved
+
+# How many prepared statements PySQLite keeps around for reuse per connection.
+# Axiom generates the same SQL text for every query of a given shape, and
+# each item type has its own INSERT, SELECT and DELETE statements on top of
+# those, so the default of 100 is easily outgrown.
+CACHED_STATEMENTS = 256
 
 class Connection(object):
     def __init__(self, connection, timeout=None):
@@ -24,8 +31,13 @@ class Connection(object):
 
 
     def fromDatabaseName(cls, dbFilename, timeout=None, isolationLevel=None):
+        # With isolationLevel left as None PySQLite issues no BEGIN or COMMIT
+        # statements of its own, so the only transactions are the explicit
+        # BEGIN IMMEDIATE ones from Store.transact, and outside of those each
+        # statement commits by itself.
         return cls(dbapi2.connect(dbFilename, timeout=0,
-                                  isolation_level=isolationLevel))
+                                  isolation_level=isolationLevel,
+                                  cached_statements=CACHED_STATEMENTS))
     fromDatabaseName = classmethod(fromDatabaseName)
 
 
@@ -33,6 +45,14 @@ class Connection(object):
         return Cursor(self, self._timeout)
 
 
+    def totalChanges(self):
+        """
+        @return: the number of rows inserted, updated or deleted through this
+        connection since it was opened.
+        """
+        return self._connection.total_changes
+
+
     def identifySQLError(self, sql, args, e):
         """
         Identify an appropriate SQL error object for the given message for the
@@ -58,6 +78,13 @@ class Cursor(object):
         return iter(self._cursor)
 
 
+    def fetchall(self):
+        """
+        Return a list of all the remaining result rows of the last statement.
+        """
+        return self._cursor.fetchall()
+
+
     def time(self):
         """
         Return the current wallclock time as a float representing seconds
@@ -76,6 +103,17 @@ class Cursor(object):
 
 
     def execute(self, sql, args=()):
+        return self._execute(self._cursor.execute, sql, args)
+
+
+    def executemany(self, sql, argsList):
+        """
+        Execute a statement once for each of a sequence of argument lists.
+        """
+        return self._execute(self._cursor.executemany, sql, argsList)
+
+
+    def _execute(self, method, sql, args):
         try:
             try:
                 blockedTime = 0.0
@@ -104,7 +142,7 @@ class Cursor(object):
                     # information between multiple processes.
                     while 1:
                         try:
-                            return self._cursor.execute(sql, args)
+                            return method(sql, args)
                         except dbapi2.OperationalError, e:
                             if e.args[0] == 'database is locked':
                                 now = self.time()
@@ -121,12 +159,13 @@ class Cursor(object):
                         log.msg('Extremely long execute: %s' % (txntime - blockedTime,))
                         log.msg(sql)
                         # import traceback; traceback.print_stack()
-                    log.msg(interface=iaxiom.IStatEvent,
-                            stat_cursor_execute_time=txntime,
-                            stat_cursor_blocked_time=blockedTime)
+                    if statsObserved():
+                        log.msg(interface=iaxiom.IStatEvent,
+                                stat_cursor_execute_time=txntime,
+                                stat_cursor_blocked_time=blockedTime)
             except dbapi2.OperationalError, e:
                 if e.args[0] == 'database schema has changed':
-                    return self._cursor.execute(sql, args)
+                    return method(sql, args)
                 raise
         except (dbapi2.ProgrammingError,
                 dbapi2.InterfaceError,
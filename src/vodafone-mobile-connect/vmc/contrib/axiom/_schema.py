@@ -44,6 +44,14 @@ SELECT *DATABASE*.axiom_types.typename, *DATABASE*.axiom_types.module, *DATABASE
         AND *DATABASE*.axiom_types.oid = *DATABASE*.axiom_objects.type_id
 """
 
+# TYPEOF_QUERY for several objects at once; interpolate one "?" per storeID.
+TYPESOF_QUERY = """
+SELECT *DATABASE*.axiom_objects.oid, *DATABASE*.axiom_types.typename, *DATABASE*.axiom_types.version
+    FROM *DATABASE*.axiom_types, *DATABASE*.axiom_objects
+    WHERE *DATABASE*.axiom_objects.oid IN (%s)
+        AND *DATABASE*.axiom_types.oid = *DATABASE*.axiom_objects.type_id
+"""
+
 HAS_SCHEMA_FEATURE = ("SELECT COUNT(oid) FROM *DATABASE*.sqlite_master "
                       "WHERE type = ? AND name = ?")
 
@@ -51,6 +59,11 @@ IDENTIFYING_SCHEMA = ('SELECT "indexed", sqltype, allow_none, attribute '
                       'FROM *DATABASE*.axiom_attributes WHERE type_id = ? '
                       'ORDER BY row_offset')
 
+# IDENTIFYING_SCHEMA for every type at once, to check them all at startup.
+ALL_IDENTIFYING_SCHEMAS = ('SELECT type_id, "indexed", sqltype, allow_none, '
+                           'attribute FROM *DATABASE*.axiom_attributes '
+                           'ORDER BY type_id, row_offset')
+
 ADD_SCHEMA_ATTRIBUTE = (
     'INSERT INTO *DATABASE*.axiom_attributes '
     '(type_id, row_offset, "indexed", sqltype, allow_none, attribute, docstring, pythontype) '
@@ -0,0 +1,27 @@
+"""
+Support for only composing L{iaxiom.IStatEvent} log messages when something
+might record them.
+"""
+
+from twisted.python import log
+
+
+def statsObserved():
+    """
+    Determine whether any log observer which might record an
+    L{iaxiom.IStatEvent} is registered.
+
+    Until logging is started Twisted installs a default observer which only
+    reports errors, so it alone does not count.  Composing a statistics
+    message costs more than some of the operations it describes, so the
+    busiest of them check this first.
+
+    @rtype: C{bool}
+    """
+    observers = log.theLogPublisher.observers
+    if not observers:
+        return False
+    defaultObserver = log.defaultObserver
+    if defaultObserver is None or len(observers) != 1:
+        return True
+    return observers[0] != defaultObserver._emit
@@ -535,6 +535,17 @@ class AttributeValueComparison:
     def getInvolvedTables(self):
         return [self.attribute.type]
 
+    def signature(self):
+        """
+        Return a hashable description of the SQL this comparison generates,
+        which is everything about it except its value, or C{None} if that
+        SQL depends on anything else.
+        """
+        if not isinstance(self.attribute.type, type):
+            # Placeholder columns are named after an alias chosen per query.
+            return None
+        return (self.attribute, self.operationString)
+
     def __repr__(self):
         return ' '.join((self.attribute.fullyQualifiedName(),
                          self.operationString,
@@ -560,6 +571,14 @@ class NullComparison:
     def getInvolvedTables(self):
         return [self.attribute.type]
 
+    def signature(self):
+        """
+        @see: L{AttributeValueComparison.signature}
+        """
+        if not isinstance(self.attribute.type, type):
+            return None
+        return (self.attribute, self.negate)
+
 class LikeFragment:
     def getLikeArgs(self):
         return []
@@ -669,6 +688,21 @@ class AggregateComparison:
                     t for t in cond.getInvolvedTables() if t not in tables])
         return tables
 
+    def signature(self):
+        """
+        @see: L{AttributeValueComparison.signature}
+        """
+        signatures = [self.operator]
+        for cond in self.conditions:
+            getSignature = getattr(cond, 'signature', None)
+            if getSignature is None:
+                return None
+            signature = getSignature()
+            if signature is None:
+                return None
+            signatures.append(signature)
+        return tuple(signatures)
+
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__,
                            ', '.join(map(repr, self.conditions)))
@@ -932,9 +966,6 @@ class text(SQLAttribute):
             if type(dbval) is str:
                 return unicode(dbval, 'ascii')
             return dbval
-    else:
-        def outfilter(self, dbval, oself):
-            return dbval
 
 class textlist(text):
     delimiter = u'\u001f'
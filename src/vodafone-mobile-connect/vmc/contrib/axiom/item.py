@@ -98,12 +98,38 @@ class MetaItem(slotmachine.SchemaMetaMachine):
 def noop():
     pass
 
+# Item subclass => (number of attributes, loadRow function); see _makeRowLoader.
+_rowLoaders = {}
+
+def _makeRowLoader(cls):
+    """
+    Generate a function which takes an instance of an Item subclass and a row
+    from its table, and calls the C{loaded} method of each of the class's
+    attributes with the corresponding value from the row.  This is the same
+    as looping over C{cls.getSchema()}, without looking up the attributes
+    again for every row.
+
+    @return: a 2-tuple of the number of attributes and the function.
+    """
+    schema = list(cls.getSchema())
+    namespace = {}
+    source = ['def loadRow(self, row):\n', '    pass\n']
+    for n, (name, attr) in enumerate(schema):
+        namespace['load%d' % (n,)] = attr.loaded
+        source.append('    load%d(self, row[%d])\n' % (n, n))
+    exec ''.join(source) in namespace
+    return len(schema), namespace['loadRow']
+
 class _StoreIDComparer(Comparable):
     """
     See Comparable's docstring for the explanation of the requirements of my implementation.
     """
     implements(IColumn)
 
+    # No two items of a type have the same storeID.  Columns which do not
+    # say so are assumed not to be unique; see store._isColumnUnique.
+    unique = True
+
     def __init__(self, type):
         self.type = type
 
@@ -304,6 +330,28 @@ def transacted(func):
 
 
 
+def dependentQueries(store, tableClass, comparisonFactory):
+    """
+    Build queries for all the items that should be deleted when an item or
+    items of a particular item type are deleted.
+
+    @param tableClass: An L{Item} subclass.
+
+    @param comparison: A one-argument callable taking an attribute and
+    returning an L{iaxiom.IComparison} describing the items to
+    collect.
+
+    @return: An iterable of L{iaxiom.IQuery} providers, one for each
+    attribute referring to C{tableClass} with C{whenDeleted ==
+    reference.CASCADE}.
+    """
+    for cascadingAttr in (_cascadingDeletes.get(tableClass, []) +
+                          _cascadingDeletes.get(None, [])):
+        yield store.query(cascadingAttr.type,
+                          comparisonFactory(cascadingAttr))
+
+
+
 def dependentItems(store, tableClass, comparisonFactory):
     """
     Collect all the items that should be deleted when an item or items
@@ -317,10 +365,8 @@ def dependentItems(store, tableClass, comparisonFactory):
 
     @return: An iterable of items to delete.
     """
-    for cascadingAttr in (_cascadingDeletes.get(tableClass, []) +
-                          _cascadingDeletes.get(None, [])):
-        for cascadedItem in store.query(cascadingAttr.type,
-                                        comparisonFactory(cascadingAttr)):
+    for query in dependentQueries(store, tableClass, comparisonFactory):
+        for cascadedItem in query:
             yield cascadedItem
 
 
@@ -534,10 +580,12 @@ class Item(Empowered, slotmachine._Strict):
                          storeID=storeID,
                          __everInserted=True)
 
-        schema = list(self.getSchema())
-        assert len(schema) == len(attrs), "invalid number of attributes"
-        for data, (name, attr) in zip(attrs, schema):
-            attr.loaded(self, data)
+        try:
+            count, loadRow = _rowLoaders[cls]
+        except KeyError:
+            count, loadRow = _rowLoaders[cls] = _makeRowLoader(cls)
+        assert count == len(attrs), "invalid number of attributes"
+        loadRow(self, attrs)
         self.activate()
         return self
     existingInStore = classmethod(existingInStore)
@@ -671,7 +719,7 @@ class Item(Empowered, slotmachine._Strict):
                 # we might have been checkpointed twice within the same
                 # transaction; just don't do anything.
                 return
-            self.store.executeSQL(*self._updateSQL())
+            self._write(*self._updateSQL())
         else:
             # case 2: we are in the middle of creating the object, we've never
             # been inserted into the db before
@@ -684,8 +732,28 @@ class Item(Empowered, slotmachine._Strict):
                 insertArgs.append(attributeValue)
 
             # XXX this isn't atomic, gross.
-            self.store.executeSQL(self._baseInsertSQL(self.store), insertArgs)
-            self.__everInserted = True
+            self._write(self._baseInsertSQL(self.store), insertArgs)
+
+    def _write(self, sql, args):
+        """
+        Run an INSERT or UPDATE statement for this item, or, if the store is
+        checkpointing many items, leave it for the store to run together with
+        the others with the same SQL once they are all collected.  Either way,
+        L{_written} is only called once the statement has run.
+        """
+        pendingWrites = self.store._pendingWrites
+        if pendingWrites is None:
+            self.store.executeSQL(sql, args)
+            self._written()
+        else:
+            pendingWrites.setdefault(sql, []).append((self, args))
+
+    def _written(self):
+        """
+        My INSERT or UPDATE statement has run, so the database is now in sync
+        with me.
+        """
+        self.__everInserted = True
         # In case 1, we're dirty but we did an update, synchronizing the
         # database, in case 2, we haven't been created but we issue an insert.
         # In either case, the code in attributes.py sets the attribute *as well
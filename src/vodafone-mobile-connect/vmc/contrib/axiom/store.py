@@ -7,7 +7,7 @@ This module holds the Axiom Store class and related classes, such as queries.
 from vmc.contrib.epsilon import hotfix
 hotfix.require('twisted', 'filepath_copyTo')
 
-import time, os, itertools, warnings, sys, operator
+import time, os, itertools, warnings, sys, operator, re
 
 from zope.interface import implements
 
@@ -24,6 +24,7 @@ from vmc.contrib.epsilon.cooperator import SchedulingService
 
 from vmc.contrib.axiom import _schema, attributes, upgrade, _fincache, iaxiom, errors, batch
 from vmc.contrib.axiom import item
+from vmc.contrib.axiom._stats import statsObserved
 
 # Doing this in a slightly awkward way so Pyflakes won't complain; it really
 # doesn't like conditional imports.
@@ -41,8 +42,46 @@ from vmc.contrib.axiom.item import \
 
 IN_MEMORY_DATABASE = ':memory:'
 
+# The file name recorded in the code objects of this module.  This is not
+# always __file__, which names the .pyc when the module was loaded from one.
+_thisFile = sys._getframe().f_code.co_filename
+
 tempCounter = itertools.count()
 
+# Matches an SQL comment, up to the end of its line.
+_sqlComment = re.compile(r'--[^\n]*')
+
+# The number of rows Store.batchInsert collects before handing them to the
+# database in one go.
+BATCH_INSERT_ROWS = 500
+
+# The number of storeIDs Store.getItemsByID looks up with each query; SQLite
+# allows no more than 999 parameters in a statement by default.
+BATCH_LOAD_ROWS = 500
+
+# The number of storeIDs whose item types Store.getItemByID remembers.
+STOREID_TYPE_CACHE_SIZE = 10000
+
+# PRAGMAs for a file-backed store with one writing process and any number of
+# readers: with a write-ahead log readers never wait for the writer, and a
+# commit is a single append to the log which is only synced to the database
+# at checkpoints.  Pass these as Store(dbdir, pragmas=WAL_PRAGMAS).  They are
+# not the default because they need SQLite 3.7.0 or newer and leave -wal and
+# -shm files next to the database.
+#
+# Concurrent readers are separate Store instances (usually in separate
+# processes), each with its own connection.  A Store is only ever used from
+# one thread, and its queries must see the uncommitted writes of its current
+# transaction, so it has no use for a pool of reading connections of its own.
+WAL_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -65536),         # KiB, i.e. 64MB
+    ('mmap_size', 268435456),
+    ('wal_autocheckpoint', 1000),   # pages
+    )
+
 class NoEmptyItems(Exception):
     """You must define some attributes on every item.
     """
@@ -131,6 +170,22 @@ def _typeIsTotallyUnknown(typename, version):
             and ((typename, version) not in _legacyTypes))
 
 
+def _padStoreIDs(storeIDs):
+    """
+    Pad a list of at most L{BATCH_LOAD_ROWS} storeIDs, by repeating the last
+    one, to the next power of two or to L{BATCH_LOAD_ROWS}.
+
+    Statements looking them up with C{IN (?, ...)} then come in a few sizes
+    only, rather than adding a new one to L{Store.statementCache} for each
+    length.
+    """
+    size = 1
+    while size < len(storeIDs):
+        size *= 2
+    size = min(size, BATCH_LOAD_ROWS)
+    return storeIDs + storeIDs[-1:] * (size - len(storeIDs))
+
+
 
 class BaseQuery:
     """
@@ -178,7 +233,13 @@ class BaseQuery:
         self.comparison = comparison
         self.limit = limit
         self.offset = offset
-        self.sort = iaxiom.IOrdering(sort)
+        if sort is None:
+            # By far the most common case, and the adapter lookup costs more
+            # than the rest of setting up the query's ordering.
+            self.sort = _unspecifiedOrdering
+        else:
+            self.sort = iaxiom.IOrdering(sort)
+        self._computeLimitClause()
         tables = self._involvedTables()
         self._computeFromClause(tables)
 
@@ -196,13 +257,9 @@ class BaseQuery:
 
 
     def __repr__(self):
-        return self.__class__.__name__ + '(' + ', '.join([
-                repr(self.store),
-                repr(self.tableClass),
-                repr(self.comparison),
-                repr(self.limit),
-                repr(self.offset),
-                repr(self.sort)]) + ')'
+        return '%s(%r, %r, %r, %r, %r, %r)' % (
+            self.__class__.__name__, self.store, self.tableClass,
+            self.comparison, self.limit, self.offset, self.sort)
 
 
     def explain(self):
@@ -231,13 +288,10 @@ class BaseQuery:
         first checking that no required tables (those in
         the query target) have been omitted from the comparison.
         """
-        # SQL and arguments
         if self.comparison is not None:
             tables = self.comparison.getInvolvedTables()
-            self.args = self.comparison.getArgs(self.store)
         else:
             tables = [self.tableClass]
-            self.args = []
 
         if self.tableClass not in tables:
             raise ValueError(
@@ -248,22 +302,34 @@ class BaseQuery:
     def _computeFromClause(self, tables):
         """
         Generate the SQL string which follows the "FROM" string and before the
-        "WHERE" string in the final SQL statement.
-        """
-        tableAliases = []
-        self.fromClauseParts = []
-        for table in tables:
-            # The indirect calls to store.getTableName() will create the tables
-            # if needed. (XXX That's bad, actually.   They should get created
-            # some other way if necessary.  -exarkun)
-            tableName = table.getTableName(self.store)
-            tableAlias = table.getTableAlias(self.store, tuple(tableAliases))
-            if tableAlias is None:
-                self.fromClauseParts.append(tableName)
-            else:
-                tableAliases.append(tableAlias)
-                self.fromClauseParts.append('%s AS %s' % (tableName,
-                                                          tableAlias))
+        "WHERE" string in the final SQL statement, and the one which follows
+        "ORDER BY".
+        """
+        # A FROM clause made only of Item classes depends on nothing but the
+        # store, so it is generated once and kept there.  Placeholders are
+        # left out: they are created per query and would pile up.
+        key = tuple(tables)
+        cache = self.store.tablesToFromClauseCache
+        if key in cache:
+            self.fromClauseParts, self.fromClause = cache[key]
+        else:
+            tableAliases = []
+            self.fromClauseParts = []
+            for table in tables:
+                # The indirect calls to store.getTableName() will create the
+                # tables if needed. (XXX That's bad, actually.   They should get
+                # created some other way if necessary.  -exarkun)
+                tableName = table.getTableName(self.store)
+                tableAlias = table.getTableAlias(self.store, tuple(tableAliases))
+                if tableAlias is None:
+                    self.fromClauseParts.append(tableName)
+                else:
+                    tableAliases.append(tableAlias)
+                    self.fromClauseParts.append('%s AS %s' % (tableName,
+                                                              tableAlias))
+            self.fromClause = ', '.join(self.fromClauseParts)
+            if all([isinstance(table, type) for table in tables]):
+                cache[key] = (self.fromClauseParts, self.fromClause)
 
         self.sortClauseParts = []
         for attr, direction in self.sort.orderColumns():
@@ -273,19 +339,14 @@ class BaseQuery:
                     "Ordering references type excluded from comparison")
             self.sortClauseParts.append(
                 '%s %s' % (attr.getColumnName(self.store), direction))
+        self.sortClause = ', '.join(self.sortClauseParts)
 
 
-    def _sqlAndArgs(self, verb, subject):
-
-        # Generate the WHERE clause separately from determining the tables
-        # which are involved so that the loop over those tables above has a
-        # chance to call getTableAlias, which may have side-effects.
-        if self.comparison is not None:
-            where = 'WHERE ' + self.comparison.getQuery(self.store)
-        else:
-            where = ''
-
-        limitClause = []
+    def _computeLimitClause(self):
+        """
+        Validate the limit and offset of this query and generate the SQL
+        string which ends the final SQL statement to apply them.
+        """
         if self.limit is not None:
             # XXX LIMIT and OFFSET used to be using ?, but they started
             # generating syntax errors in places where generating the whole SQL
@@ -294,56 +355,104 @@ class BaseQuery:
             # sure -glyph
             if not isinstance(self.limit, (int, long)):
                 raise TypeError("limit must be an integer: %r" % (self.limit,))
-            limitClause.append('LIMIT')
-            limitClause.append(str(self.limit))
             if self.offset is not None:
                 if not isinstance(self.offset, (int, long)):
                     raise TypeError("offset must be an integer: %r" % (self.offset,))
-                limitClause.append('OFFSET')
-                limitClause.append(str(self.offset))
+                self.limitClause = 'LIMIT %d OFFSET %d' % (self.limit,
+                                                           self.offset)
+            else:
+                self.limitClause = 'LIMIT %d' % (self.limit,)
         else:
             assert self.offset is None, 'Offset specified without limit'
+            self.limitClause = ''
 
-        sqlParts = [verb, subject]
-        if self.fromClauseParts:
-            sqlParts.extend(['FROM', ', '.join(self.fromClauseParts)])
-        if self.comparison is not None:
-            sqlParts.extend(['WHERE', self.comparison.getQuery(self.store)])
-        if self.sortClauseParts:
-            sqlParts.extend(['ORDER BY', ', '.join(self.sortClauseParts)])
-        if limitClause:
-            sqlParts.append(' '.join(limitClause))
-        sqlstr = ' '.join(sqlParts)
+
+    _sqlCache = None
+    args = None
+    def _sqlAndArgs(self, verb, subject):
+        """
+        Generate the SQL for this query with a particular verb and subject,
+        and return it along with its bind arguments.
+
+        The generated SQL depends only on the verb, the subject and the shape
+        of this query, none of which change after construction, so it is
+        cached per (verb, subject) on this instance; arguments are always
+        bound by placeholder and are simply handed back alongside it.  They
+        are converted for the database the first time they are needed, since
+        plenty of queries are built only to be cloned or wrapped.
+        """
+        if self._sqlCache is None:
+            self._sqlCache = {}
+        key = (verb, subject)
+        sqlstr = self._sqlCache.get(key)
+        if sqlstr is None:
+            sqlstr = self._sqlCache[key] = self._generateSQL(verb, subject)
+        if self.args is None:
+            if self.comparison is not None:
+                self.args = self.comparison.getArgs(self.store)
+            else:
+                self.args = []
         return (sqlstr, self.args)
 
 
-    def _runQuery(self, verb, subject):
-        # XXX ideally this should be creating an SQL cursor and iterating
-        # through that so we don't have to load the whole query into memory,
-        # but right now Store's interface to SQL is all through one cursor.
-        # I'm not sure how to do this and preserve the chokepoint so that we
-        # can do, e.g. transaction fallbacks.
+    _sqlTail = None
+    def _generateSQL(self, verb, subject):
+        """
+        Generate the SQL for this query with a particular verb and subject.
+
+        Everything following the subject is the same for all of them, so it
+        is generated the first time and each new verb and subject is simply
+        joined to it.
+        """
+        if self._sqlTail is None:
+            # Generate the WHERE clause separately from determining the tables
+            # which are involved so that the loop over those tables above has
+            # a chance to call getTableAlias, which may have side-effects.
+            sqlParts = ['']
+            if self.fromClause:
+                sqlParts.extend(['FROM', self.fromClause])
+            if self.comparison is not None:
+                sqlParts.extend(['WHERE', self.comparison.getQuery(self.store)])
+            if self.sortClause:
+                sqlParts.extend(['ORDER BY', self.sortClause])
+            if self.limitClause:
+                sqlParts.append(self.limitClause)
+            self._sqlTail = ' '.join(sqlParts)
+        return verb + ' ' + subject + self._sqlTail
+
+
+    def _runQuery(self, verb, subject, stream=False):
+        # By default the whole result is loaded into memory: callers are free
+        # to modify the store while walking it, and SQLite leaves the results
+        # of a statement undefined if its tables change before it finishes.
+        # Readers which promise not to do that can pass stream=True to have
+        # rows fetched from a cursor of their own as they are consumed.
         t = time.time()
         if not self.store.autocommit:
             self.store.checkpoint()
         sqlstr, sqlargs = self._sqlAndArgs(verb, subject)
-        sqlResults = self.store.querySQL(sqlstr, sqlargs)
-        cs = self.locateCallSite()
-        log.msg(interface=iaxiom.IStatEvent,
-                querySite=cs, queryTime=time.time() - t, querySQL=sqlstr)
+        if stream:
+            sqlResults = self.store.querySQLCursor(sqlstr, sqlargs)
+        else:
+            sqlResults = self.store.querySQL(sqlstr, sqlargs)
+        if statsObserved():
+            cs = self.locateCallSite()
+            log.msg(interface=iaxiom.IStatEvent,
+                    querySite=cs, queryTime=time.time() - t, querySQL=sqlstr)
         return sqlResults
 
     def locateCallSite(self):
-        i = 3
-        frame = sys._getframe(i)
-        while frame.f_code.co_filename == __file__:
+        if not statsObserved():
+            # Nobody will see the IStatEvent this is being looked up for.
+            return ('', 0)
+        frame = sys._getframe(3)
+        while frame.f_code.co_filename == _thisFile:
             #let's not get stuck in findOrCreate, etc
-            i += 1
-            frame = sys._getframe(i)
+            frame = frame.f_back
         return (frame.f_code.co_filename, frame.f_lineno)
 
 
-    def _selectStuff(self, verb='SELECT'):
+    def _selectStuff(self, verb='SELECT', stream=False):
         """
         Return a generator which yields the massaged results of this query with
         a particular SQL verb.
@@ -355,10 +464,13 @@ class BaseQuery:
         @param verb: a str containing the SQL verb to execute.  This really
         must be some variant of 'SELECT', the only two currently implemented
         being 'SELECT' and 'SELECT DISTINCT'.
+
+        @param stream: if true, fetch rows from the database as they are
+        consumed rather than loading them all before yielding the first one.
         """
-        sqlResults = self._runQuery(verb, self._queryTarget)
-        for row in sqlResults:
-            yield self._massageData(row)
+        massage = self._massageData
+        for row in self._runQuery(verb, self._queryTarget, stream):
+            yield massage(row)
 
 
     def _massageData(self, row):
@@ -416,6 +528,43 @@ class BaseQuery:
         return self._selectStuff('SELECT')
 
 
+    def iterate(self):
+        """
+        Iterate the results of this query, fetching them from the database as
+        they are consumed rather than all at once.
+
+        This keeps memory use constant no matter how large the result set is,
+        and lets a loop which stops early avoid fetching the rest of it.  In
+        exchange, the store must not be modified until iteration finishes (or
+        the iterator is discarded): SQLite does not define what a statement
+        returns if its tables change while it is running.
+        """
+        return self._selectStuff('SELECT', stream=True)
+
+
+    def iterBatches(self, batchSize=1000):
+        """
+        Iterate the results of this query in lists, fetching each one from the
+        database as it is needed.
+
+        The same restriction as for L{iterate} applies: the store must not be
+        modified until iteration finishes, not even between batches.
+
+        @param batchSize: the greatest number of results to put in each list.
+        @type batchSize: L{int}
+
+        @return: an iterable which yields lists of results.
+        """
+        massage = self._massageData
+        rows = self._runQuery('SELECT', self._queryTarget, stream=True)
+        while True:
+            batch = [massage(row)
+                     for row in itertools.islice(rows, batchSize)]
+            if not batch:
+                return
+            yield batch
+
+
     _selfiter = None
     def next(self):
         """
@@ -441,6 +590,23 @@ class _FakeItemForFilter:
         self.store = store
 
 
+# What iaxiom.IOrdering(None) would make; it has no state, so one will do.
+_unspecifiedOrdering = attributes.UnspecifiedOrdering(None)
+
+
+def _outfilterIsIdentity(attribute):
+    """
+    Determine whether an attribute's C{outfilter} returns database values
+    unchanged, as it does for integers, text and storeIDs, so that calling it
+    can be skipped.
+
+    @param attribute: an L{IColumn} provider
+    """
+    outfilter = getattr(attribute.outfilter, 'im_func', None)
+    return outfilter in (attributes.SQLAttribute.outfilter.im_func,
+                         _StoreIDComparer.outfilter.im_func)
+
+
 def _isColumnUnique(col):
     """
     Determine if an IColumn provider is unique.
@@ -448,7 +614,68 @@ def _isColumnUnique(col):
     @param col: an L{IColumn} provider
     @return: True if the IColumn provider is unique, False otherwise.
     """
-    return isinstance(col, _StoreIDComparer)
+    return getattr(col, 'unique', False)
+
+
+def _itemQueryTarget(store, tableClass):
+    """
+    Determine the SQL column list which selects items of a particular type.
+
+    This does not change for a given store and item type, so it is computed
+    once and kept in the store's C{typeToQueryTargetCache}.
+
+    @param store: the L{Store} the items are in.
+    @param tableClass: a subclass of L{Item}.
+
+    @return: a 2-tuple of the column list as a L{str} and the number of
+    columns in it (the item's attributes plus its storeID).
+    """
+    cache = store.typeToQueryTargetCache
+    if tableClass not in cache:
+        schema = list(tableClass.getSchema())
+        cache[tableClass] = (
+            tableClass.storeID.getColumnName(store) + ', ' + (
+                ', '.join(
+                    [attrobj.getColumnName(store)
+                     for name, attrobj in schema
+                     ])),
+            len(schema) + 1)
+    return cache[tableClass]
+
+
+def _itemMassager(loadedItem, tableClass):
+    """
+    Make a function which does what L{ItemQuery._massageData} does for a
+    particular store and item type, without looking either up for each row.
+
+    @param loadedItem: the C{_loadedItem} method of the store.
+    @param tableClass: a subclass of L{Item}.
+    """
+    def massage(row):
+        result = loadedItem(tableClass, row[0], row[1:])
+        assert result.store is not None, "result %r has funky store" % (result,)
+        return result
+    return massage
+
+
+def _multipleItemMassager(loadedItem, sliceSpecs):
+    """
+    Make a function which does what L{MultipleItemQuery._massageData} does for
+    a particular store and list of item types, without looking either up for
+    each row.
+
+    @param loadedItem: the C{_loadedItem} method of the store.
+    @param sliceSpecs: a list of 3-tuples of an item type, the index of its
+    storeID in a row and a C{slice} of the row holding its other columns.
+    """
+    def massage(row):
+        resultBits = []
+        for tableClass, idIndex, attrs in sliceSpecs:
+            result = loadedItem(tableClass, row[idIndex], row[attrs])
+            assert result.store is not None, "result %r has funky store" % (result,)
+            resultBits.append(result)
+        return tuple(resultBits)
+    return massage
 
 class ItemQuery(BaseQuery):
     """
@@ -461,12 +688,12 @@ class ItemQuery(BaseQuery):
         Create an ItemQuery.  This is typically done via L{Store.query}.
         """
         BaseQuery.__init__(self, *a, **k)
-        self._queryTarget = (
-            self.tableClass.storeID.getColumnName(self.store) + ', ' + (
-                ', '.join(
-                    [attrobj.getColumnName(self.store)
-                     for name, attrobj in self.tableClass.getSchema()
-                     ])))
+        self._queryTarget = _itemQueryTarget(self.store, self.tableClass)[0]
+        self._loadedItem = self.store._loadedItem
+        if (self.__class__._massageData.im_func is
+            ItemQuery._massageData.im_func):
+            self._massageData = _itemMassager(self._loadedItem,
+                                              self.tableClass)
 
 
     def paginate(self, pagesize=20):
@@ -506,56 +733,52 @@ class ItemQuery(BaseQuery):
             # the future we will have more of this.
             tiebreaker = None
         else:
+            # Otherwise break ties by storeID, so that (sort value, storeID)
+            # identifies a unique position in the results to resume from.
             tiebreaker = self.tableClass.storeID
+            sort = sort + tiebreaker.ascending
 
-        tied = lambda a, b: (sortColumn.__get__(a) ==
-                             sortColumn.__get__(b))
         def _AND(a, b):
             if a is None:
                 return b
             return attributes.AND(a, b)
 
-        results = list(self.store.query(self.tableClass, self.comparison,
-                                        sort=sort, limit=pagesize + 1))
-        while results:
-            if len(results) == 1:
-                # XXX TODO: reject 0 pagesize.  If the length of the result set
-                # is 1, there's no next result to test for a tie with, so we
-                # must be at the end, and we should just yield the result and finish.
-                yield results[0]
+        comparison = self.comparison
+        while True:
+            # Each page is read to the end before any of it is handed out, so
+            # it can be streamed straight into the list of items rather than
+            # loading a list of rows first.
+            results = list(self.store.query(self.tableClass, comparison,
+                                            sort=sort,
+                                            limit=pagesize).iterate())
+            if not results:
                 return
-            for resultidx in range(len(results) - 1):
-                # check for a tie.
-                result = results[resultidx]
-                nextResult = results[resultidx + 1]
-                if tied(result, nextResult):
-                    # Yield any ties first, in the appropriate order.
-                    lastTieBreaker = tiebreaker.__get__(result)
-                    # Note that this query is _NOT_ limited: currently large ties
-                    # will generate arbitrarily large amounts of work.
-                    trq = self.store.query(
-                        self.tableClass,
-                        _AND(self.comparison,
-                             sortColumn == sortColumn.__get__(result)))
-                    tiedResults = list(trq)
-                    tiedResults.sort(key=lambda rslt: (sortColumn.__get__(result),
-                                                       tiebreaker.__get__(result)))
-                    for result in tiedResults:
-                        yield result
-                    # re-start the query here ('result' is set to the
-                    # appropriate value by the inner loop)
-                    break
+            # Note where this page ends before handing its results out, in
+            # case they are changed before the next page is asked for.
+            lastSortValue = sortColumn.__get__(results[-1])
+            if tiebreaker is None:
+                after = sortOp(sortColumn, lastSortValue)
+            else:
+                tied = attributes.AND(
+                    sortColumn == lastSortValue,
+                    tiebreaker > tiebreaker.__get__(results[-1]))
+                # NULL sorts before everything else, and can't be compared
+                # with '<' or '>'.
+                if lastSortValue is None:
+                    if sortOp is operator.gt:
+                        after = attributes.OR(sortColumn != None, tied)
+                    else:
+                        after = tied
+                elif sortOp is operator.gt:
+                    after = attributes.OR(sortColumn > lastSortValue, tied)
                 else:
-                    yield result
-
-            lastSortValue = sortColumn.__get__(result) # hooray namespace pollution
-            results = list(self.store.query(
-                    self.tableClass,
-                    _AND(self.comparison,
-                         sortOp(sortColumn,
-                                sortColumn.__get__(result))),
-                    sort=sort,
-                    limit=pagesize + 1))
+                    after = attributes.OR(sortColumn < lastSortValue,
+                                          sortColumn == None, tied)
+            for result in results:
+                yield result
+            if len(results) < pagesize:
+                return
+            comparison = _AND(self.comparison, after)
 
     def _massageData(self, row):
         """
@@ -567,7 +790,7 @@ class ItemQuery(BaseQuery):
 
         @return: an instance of the type specified by this query.
         """
-        result = self.store._loadedItem(self.tableClass, row[0], row[1:])
+        result = self._loadedItem(self.tableClass, row[0], row[1:])
         assert result.store is not None, "result %r has funky store" % (result,)
         return result
 
@@ -603,10 +826,18 @@ class ItemQuery(BaseQuery):
 
 
     def count(self):
-        rslt = self._runQuery(
-            'SELECT',
-            'COUNT(' + self.tableClass.storeID.getColumnName(self.store)
-            + ')')
+        if self.comparison is None and self.limit is None:
+            # Counting every item of a type is a scan of its whole table, so
+            # the store remembers the result for as long as it stays valid.
+            return self.store._unlessChanged(
+                self.store._itemCountCache, self.tableClass, self._countRows)
+        return self._countRows()
+
+
+    def _countRows(self):
+        # storeID is never NULL, so there is nothing for COUNT to check on
+        # each row; COUNT(*) lets SQLite just count them.
+        rslt = self._runQuery('SELECT', 'COUNT(*)')
         assert len(rslt) == 1, 'more than one result: %r' % (rslt,)
         return rslt[0][0] or 0
 
@@ -641,9 +872,25 @@ class ItemQuery(BaseQuery):
                     'Cannot delete item; '
                     'has referents with whenDeleted == reference.DISALLOW')
 
-            for it in item.dependentItems(self.store,
-                                          self.tableClass, itemsToDelete):
-                it.deleteFromStore()
+            # Delete each kind of dependent item with a query of its own, so
+            # that it can take this fast path too.  Only bother if there are
+            # any: besides saving the work, this is what stops the recursion
+            # for items which cascade to items of their own type.  Loaded
+            # dependents have to go one by one, as a bare DELETE would leave
+            # them in the object cache as if they still existed.
+            isLoaded = self.store.objectCache.has
+            for query in item.dependentQueries(self.store,
+                                               self.tableClass, itemsToDelete):
+                storeIDs = list(query.getColumn("storeID"))
+                if not storeIDs:
+                    continue
+                for storeID in storeIDs:
+                    if isLoaded(storeID):
+                        for dependent in query:
+                            dependent.deleteFromStore()
+                        break
+                else:
+                    query.deleteFromStore()
 
             # actually run the DELETE for the items in this query.
             self._runQuery('DELETE', "")
@@ -672,22 +919,31 @@ class MultipleItemQuery(BaseQuery):
         # This records the slice lengths.
         self.schemaLengths = []
 
+        # And this records, for each item class, where in the row its storeID
+        # and the rest of its columns are.
+        self._sliceSpecs = []
+
         # self.tableClass is a tuple of Item classes.
+        offset = 0
         for tableClass in self.tableClass:
+            target, length = _itemQueryTarget(self.store, tableClass)
+            self.schemaLengths.append(length)
+            self._sliceSpecs.append(
+                (tableClass, offset, slice(offset + 1, offset + length)))
+            targets.append(target)
+            offset += length
 
-            schema = tuple(tableClass.getSchema())
-
-            # The extra 1 is oid
-            self.schemaLengths.append(len(schema) + 1)
+        self._queryTarget = ', '.join(targets)
 
-            targets.append(
-                tableClass.storeID.getColumnName(self.store) + ', ' + (
-                ', '.join(
-                [attrobj.getColumnName(self.store)
-                 for name, attrobj in schema
-                 ])))
+        # Counting only needs to select the storeIDs.
+        self._storeIDTarget = ', '.join([
+            tableClass.storeID.getColumnName(self.store)
+            for tableClass in self.tableClass ])
 
-        self._queryTarget = ', '.join(targets)
+        if (self.__class__._massageData.im_func is
+            MultipleItemQuery._massageData.im_func):
+            self._massageData = _multipleItemMassager(self.store._loadedItem,
+                                                      self._sliceSpecs)
 
     def _involvedTables(self):
         """
@@ -695,13 +951,10 @@ class MultipleItemQuery(BaseQuery):
         first checking that no required tables (those in
         the query target) have been omitted from the comparison.
         """
-        # SQL and arguments
         if self.comparison is not None:
             tables = self.comparison.getInvolvedTables()
-            self.args = self.comparison.getArgs(self.store)
         else:
             tables = list(self.tableClass)
-            self.args = []
 
         for tableClass in self.tableClass:
             if tableClass not in tables:
@@ -723,20 +976,14 @@ class MultipleItemQuery(BaseQuery):
 
         @return: a tuple of instances of the types specified by this query.
         """
-        offset = 0
+        loadedItem = self.store._loadedItem
         resultBits = []
 
-        for i, tableClass in enumerate(self.tableClass):
-            numAttrs = self.schemaLengths[i]
-
-            result = self.store._loadedItem(self.tableClass[i],
-                                            row[offset],
-                                            row[offset+1:offset+numAttrs])
+        for tableClass, idIndex, attrs in self._sliceSpecs:
+            result = loadedItem(tableClass, row[idIndex], row[attrs])
             assert result.store is not None, "result %r has funky store" % (result,)
             resultBits.append(result)
 
-            offset += numAttrs
-
         return tuple(resultBits)
 
     def count(self):
@@ -747,10 +994,7 @@ class MultipleItemQuery(BaseQuery):
         """
         if not self.store.autocommit:
             self.store.checkpoint()
-        target = ', '.join([
-            tableClass.storeID.getColumnName(self.store)
-            for tableClass in self.tableClass ])
-        sql, args = self._sqlAndArgs('SELECT', target)
+        sql, args = self._sqlAndArgs('SELECT', self._storeIDTarget)
         sql = 'SELECT COUNT(*) FROM (' + sql + ')'
         result = self.store.querySQL(sql, args)
         assert len(result) == 1, 'more than one result: %r' % (result,)
@@ -808,6 +1052,10 @@ class _DistinctQuery(object):
 
         @return: an L{int} representing the number of distinct results.
         """
+        if (isinstance(self.query, ItemQuery)
+            and self.query.comparison is None and self.query.limit is None):
+            # Every item in a table is already distinct.
+            return self.query.count()
         if not self.query.store.autocommit:
             self.query.store.checkpoint()
         sql, args = self.query._sqlAndArgs(
@@ -832,12 +1080,9 @@ class _MultipleItemDistinctQuery(_DistinctQuery):
         """
         if not self.query.store.autocommit:
             self.query.store.checkpoint()
-        target = ', '.join([
-            tableClass.storeID.getColumnName(self.query.store)
-            for tableClass in self.query.tableClass ])
         sql, args = self.query._sqlAndArgs(
             'SELECT DISTINCT',
-            target)
+            self.query._storeIDTarget)
         sql = 'SELECT COUNT(*) FROM (' + sql + ')'
         result = self.query.store.querySQL(sql, args)
         assert len(result) == 1, 'more than one result: %r' % (result,)
@@ -865,6 +1110,7 @@ class AttributeQuery(BaseQuery):
         self.attribute = attribute
         self.raw = raw
         self._queryTarget = attribute.getColumnName(self.store)
+        self._outfilterIsIdentity = _outfilterIsIdentity(attribute)
 
 
     _cloneAttributes = BaseQuery._cloneAttributes + 'attribute raw'.split()
@@ -881,18 +1127,25 @@ class AttributeQuery(BaseQuery):
 
         @return: a value of the type described by my attribute.
         """
-        if self.raw:
+        if self.raw or self._outfilterIsIdentity:
             return row[0]
-        return self.attribute.outfilter(row[0], _FakeItemForFilter(self.store))
+        return self.attribute.outfilter(row[0], self.store._fakeItemForFilter)
+
+
+    def _outfilter(self, dbval):
+        """
+        Convert a database value to the type described by my attribute.
+        """
+        if self._outfilterIsIdentity:
+            return dbval
+        return self.attribute.outfilter(dbval, self.store._fakeItemForFilter)
 
 
     def count(self):
         """
         @return: the number of non-None values of this attribute specified by this query.
         """
-        rslt = self._runQuery('SELECT', 'COUNT(%s)' % (self._queryTarget,)) or [(0,)]
-        assert len(rslt) == 1, 'more than one result: %r' % (rslt,)
-        return rslt[0][0]
+        return self._runFunction('COUNT', 0)
 
 
 
@@ -906,10 +1159,8 @@ class AttributeQuery(BaseQuery):
 
         @return: a number or None.
         """
-        res = self._runQuery('SELECT', 'SUM(%s)' % (self._queryTarget,)) or [(0,)]
-        assert len(res) == 1, "more than one result: %r" % (res,)
-        dbval = res[0][0] or 0
-        return self.attribute.outfilter(dbval, _FakeItemForFilter(self.store))
+        dbval = self._runFunction('SUM', 0) or 0
+        return self._outfilter(dbval)
 
 
     def average(self):
@@ -922,9 +1173,34 @@ class AttributeQuery(BaseQuery):
 
         @return: a L{float} representing the 'average' value of this column.
         """
-        rslt = self._runQuery('SELECT', 'AVG(%s)' % (self._queryTarget,)) or [(0,)]
-        assert len(rslt) == 1, 'more than one result: %r' % (rslt,)
-        return rslt[0][0]
+        return self._runFunction('AVG', 0)
+
+
+    _aggregatesTarget = None
+    def aggregates(self):
+        """
+        Compute what L{count}, L{sum}, L{average}, L{min} and L{max} would
+        return, with a single statement rather than one for each.
+
+        Like the methods it combines, the result reflects the current contents
+        of the store.
+
+        @return: a 5-tuple of the count, sum, average, minimum and maximum of
+        the values specified by this query.  If there are none, the minimum
+        and maximum are None rather than an exception being raised.
+        """
+        if self._aggregatesTarget is None:
+            self._aggregatesTarget = ', '.join([
+                    '%s(%s)' % (which, self._queryTarget)
+                    for which in ('COUNT', 'SUM', 'AVG', 'MIN', 'MAX')])
+        count, dbsum, average, dbmin, dbmax = self._runFunctions(
+            self._aggregatesTarget)
+        outfilter = self._outfilter
+        if dbmin is not None:
+            dbmin = outfilter(dbmin)
+        if dbmax is not None:
+            dbmax = outfilter(dbmax)
+        return (count, outfilter(dbsum or 0), average, dbmin, dbmax)
 
 
     def max(self, default=_noDefault):
@@ -935,17 +1211,61 @@ class AttributeQuery(BaseQuery):
         return self._functionOnTarget('MIN', default)
 
 
+    _functionTargets = None
+    def _runFunction(self, which, empty):
+        """
+        Apply an SQL aggregate function to the values specified by this query.
+
+        The SQL for each function is generated once per query, so asking for
+        the same aggregate again reuses both it and the statement cached for it.
+
+        @param which: the name of the SQL function, such as C{'SUM'}.
+        @param empty: the value to return if the query returns no row at all.
+
+        @return: the database value produced by the function.
+        """
+        if self._functionTargets is None:
+            self._functionTargets = {}
+        target = self._functionTargets.get(which)
+        if target is None:
+            target = self._functionTargets[which] = '%s(%s)' % (
+                which, self._queryTarget)
+        return self._runFunctions(target, (empty,))[0]
+
+
+    _functionResults = None
+    def _runFunctions(self, target, empty=None):
+        """
+        Select some SQL aggregate functions of the values specified by this
+        query.
+
+        Each result is remembered and returned again without running the
+        query for as long as nothing has changed the database, so asking the
+        same query for, say, its maximum over and over only scans the values
+        again once something has changed.
+
+        @param target: the functions to select, as SQL.
+        @param empty: the row to return if the query returns no row at all.
+
+        @return: the row of database values the functions produced.
+        """
+        if self._functionResults is None:
+            self._functionResults = {}
+        def compute():
+            rslt = self._runQuery('SELECT', target) or [empty]
+            assert len(rslt) == 1, 'more than one result: %r' % (rslt,)
+            return rslt[0]
+        return self.store._unlessChanged(self._functionResults, target, compute)
+
+
     def _functionOnTarget(self, which, default):
-        rslt = self._runQuery('SELECT', '%s(%s)' %
-                              (which, self._queryTarget,)) or [(None,)]
-        assert len(rslt) == 1, 'more than one result: %r' % (rslt,)
-        dbval = rslt[0][0]
+        dbval = self._runFunction(which, None)
         if dbval is None:
             if default is _noDefault:
                 raise ValueError, '%s() on table with no items'%(which)
             else:
                 return default
-        return self.attribute.outfilter(dbval, _FakeItemForFilter(self.store))
+        return self._outfilter(dbval)
 
 
 
@@ -1008,7 +1328,8 @@ class Store(Empowered):
         else:
             return False
 
-    def __init__(self, dbdir=None, filesdir=None, debug=False, parent=None, idInParent=None):
+    def __init__(self, dbdir=None, filesdir=None, debug=False, parent=None, idInParent=None,
+                 pragmas=(), mmapSize=None):
         """
         Create a store.
 
@@ -1030,6 +1351,17 @@ class Store(Empowered):
         L{axiom.substore.Substore}, the storeID of the item within its parent
         which opened it.
 
+        @param pragmas: a sequence of 2-tuples of the name and value of an
+        SQLite PRAGMA to set whenever the database is opened, for example
+        C{[('journal_mode', 'WAL'), ('synchronous', 'NORMAL')]}; see
+        L{WAL_PRAGMAS}.  By default SQLite's own settings are left alone.
+
+        @param mmapSize: if not C{None}, the number of bytes of the database
+        file SQLite should access through a memory map rather than C{read()}
+        calls (C{PRAGMA mmap_size}).  This helps read-heavy stores whose
+        working set does not fit in the page cache.  Ignored by versions of
+        SQLite older than 3.7.17.
+
         @raises ValueError: if both C{dbdir} and C{filesdir} are specified
         """
         if parent is not None or idInParent is not None:
@@ -1038,14 +1370,19 @@ class Store(Empowered):
         self.parent = parent
         self.idInParent = idInParent
         self.debug = debug
+        if mmapSize is not None:
+            pragmas = list(pragmas) + [('mmap_size', int(mmapSize))]
+        self.pragmas = pragmas
         self.autocommit = True
-        self.queryTimes = []
-        self.execTimes = []
+        self.queryTimes = _Timings()
+        self.execTimes = _Timings()
 
         self._attachedChildren = {} # database name => child store object
 
         self.statementCache = {} # non-normalized => normalized qmark SQL
                                  # statements
+        self._schemaSQLCache = {} # schema SQL with *DATABASE* => normalized
+                                  # SQL naming this store's database
 
         self.activeTables = {}  # tables which have had items added/removed
                                 # this run
@@ -1066,6 +1403,18 @@ class Store(Empowered):
 
         self.typeToTableNameCache = {}
         self.attrToColumnNameCache = {}
+        self._columnNamesCachedFor = {} # Item subclass => attributes of it
+                                        # in attrToColumnNameCache
+        self.typeToQueryTargetCache = {}
+        self.tablesToFromClauseCache = {}
+        self._fastLookupSQL = {}
+        self._storeIDTypeCache = {} # storeID => (typeName, schemaVersion)
+        self._itemCountCache = {}
+        self._changeGeneration = 0
+        # Attribute filters only ever read .store and .__legacy__ from the
+        # item they are given, so one stand-in serves every attribute query
+        # and batch insert against this store.
+        self._fakeItemForFilter = _FakeItemForFilter(self)
 
         self._oldTypesRemaining = [] # a list of old types which have not been
                                      # fully upgraded in this database.
@@ -1154,12 +1503,30 @@ class Store(Empowered):
         self._childCounter += 1
         databaseName = 'child_db_%d' % (self._childCounter,)
         self._attachedChildren[databaseName] = child
+        self._refreshAttached()
         # ATTACH DATABASE statements can't use bind paramaters, blech.
         self.executeSQL("ATTACH DATABASE '%s' AS %s" % (
                 child.dbdir.child('db.sqlite').path,
                 databaseName,))
         return databaseName
 
+    # Every store attached below this one, directly or not, each listed before
+    # the stores attached to it.
+    _attachedDescendants = ()
+
+    def _refreshAttached(self):
+        """
+        Recompute L{_attachedDescendants} for this store and the stores it is
+        attached to, after a store has been attached below it.
+        """
+        descendants = []
+        for sub in self._attachedChildren.values():
+            descendants.append(sub)
+            descendants.extend(sub._attachedDescendants)
+        self._attachedDescendants = tuple(descendants)
+        if self.attachedToParent:
+            self.parent._refreshAttached()
+
     attachedToParent = False
 
     def attachToParent(self):
@@ -1170,19 +1537,29 @@ class Store(Empowered):
 
         self.attachedToParent = True
         self.databaseName = self.parent._attachChild(self)
+        self._schemaSQLCache.clear()
         self.connection = self.parent.connection
         self.cursor = self.parent.cursor
+        # A different connection keeps a different count of its changes.
+        self._changeGeneration += 1
 
 #     def detachFromParent(self):
 #         pass
 
 
     def _initSchema(self):
-        # No point in even attempting to transactionalize this:
-        # every single statement is a CREATE TABLE or a CREATE
-        # INDEX and those commit transactions silently anyway.
-        for stmt in _schema.BASE_SCHEMA:
-            self.executeSchemaSQL(stmt)
+        # The connection is not in the driver's implicit transaction mode, so
+        # CREATE TABLE and CREATE INDEX do not commit on their own; doing them
+        # all in one transaction makes creating a database one disk sync
+        # rather than one for each statement.
+        self.cursor.execute("BEGIN IMMEDIATE TRANSACTION")
+        try:
+            for stmt in _schema.BASE_SCHEMA:
+                self.executeSchemaSQL(stmt)
+        except:
+            self.cursor.execute("ROLLBACK")
+            raise
+        self.cursor.execute("COMMIT")
 
 
     def _startup(self):
@@ -1192,11 +1569,15 @@ class Store(Empowered):
         version information for upgrader service to run later.
         """
         typesToCheck = []
+        newestVersions = {}
         for oid, module, typename, version in self.querySchemaSQL(_schema.ALL_TYPES):
             if self.debug:
                 print
                 print 'SCHEMA:', oid, module, typename, version
             self.typenameAndVersionToID[typename, version] = oid
+            if (typename not in newestVersions
+                or version > newestVersions[typename]):
+                newestVersions[typename] = version
             if typename not in _typeNameToMostRecentClass:
                 try:
                     namedAny(module)
@@ -1212,8 +1593,18 @@ class Store(Empowered):
                 else:
                     typesToCheck.append(cls)
 
+        # Load the stored schema of every type with one query rather than one
+        # for each type.
+        onDiskSchemas = {}
+        for row in self.querySchemaSQL(_schema.ALL_IDENTIFYING_SCHEMAS):
+            onDiskSchemas.setdefault(row[0], []).append(row[1:])
+
         for cls in typesToCheck:
-            self.checkTypeSchemaConsistency(cls)
+            typeID = self.typenameAndVersionToID[cls.typeName,
+                                                 cls.schemaVersion]
+            self.checkTypeSchemaConsistency(
+                cls, onDiskSchemas.get(typeID, []),
+                newestVersions[cls.typeName])
 
         # Schema is consistent!  Now, if I forgot to create any indexes last
         # time I saw this table, do it now...
@@ -1261,6 +1652,14 @@ class Store(Empowered):
     def _initdb(self, dbfname):
         self.connection = Connection.fromDatabaseName(dbfname)
         self.cursor = self.connection.cursor()
+        for name, value in self.pragmas:
+            # PRAGMA statements do not accept bind parameters.
+            rows = self.querySQL('PRAGMA %s = %s' % (name, value))
+            if name == 'journal_mode':
+                # SQLite quietly keeps the old mode if it can't switch, for
+                # example to WAL for an in-memory database.
+                log.msg('SQLite journal mode for %s: %s' % (
+                        dbfname, rows and rows[0][0]))
 
 
     def __repr__(self):
@@ -1299,13 +1698,14 @@ class Store(Empowered):
             andargs.append(col == v)
 
         if len(andargs) == 0:
-            cond = []
+            cond = None
         elif len(andargs) == 1:
-            cond = [andargs[0]]
+            cond = andargs[0]
         else:
-            cond = [attributes.AND(*andargs)]
+            cond = attributes.AND(*andargs)
 
-        for result in self.query(userItemClass, *cond):
+        result = self.findFirst(userItemClass, cond)
+        if result is not None:
             return result
         newItem = userItemClass(store=self, **attrs)
         if __ifnew is not None:
@@ -1349,11 +1749,17 @@ class Store(Empowered):
             p = p.child(subdir)
         return p
 
-    def checkTypeSchemaConsistency(self, actualType):
+    def checkTypeSchemaConsistency(self, actualType, onDiskSchema=None,
+                                   newestVersion=None):
         """
         Called for all known types at database startup: make sure that what we know
         (in memory) about this type is
 
+        @param onDiskSchema: the rows L{_schema.IDENTIFYING_SCHEMA} returns for
+        this type, if they have already been loaded.
+
+        @param newestVersion: the greatest version of this type in the
+        database, if it is already known.
         """
         # make sure that both the runtime and the database both know about this
         # type; if they don't both know, we can't check that their views are
@@ -1369,13 +1775,14 @@ class Store(Empowered):
         typeID = self.typenameAndVersionToID[actualType.typeName,
                                              actualType.schemaVersion]
 
+        if onDiskSchema is None:
+            onDiskSchema = self.querySchemaSQL(_schema.IDENTIFYING_SCHEMA,
+                                               [typeID])
         onDiskSchema = [(ondisksqltype, ondiskattrname) for
                         (ondiskindexed,
                          ondisksqltype,
                          ondiskallownone,
-                         ondiskattrname) in
-                        self.querySchemaSQL(_schema.IDENTIFYING_SCHEMA,
-                                           [typeID])]
+                         ondiskattrname) in onDiskSchema]
 
         if inMemorySchema != onDiskSchema:
             raise RuntimeError(
@@ -1387,9 +1794,13 @@ class Store(Empowered):
         if actualType.__legacy__:
             return
 
-        if self.querySchemaSQL(_schema.GET_GREATER_VERSIONS_OF_TYPE,
-                               [actualType.typeName,
-                                actualType.schemaVersion]):
+        if newestVersion is not None:
+            greaterVersions = newestVersion > actualType.schemaVersion
+        else:
+            greaterVersions = self.querySchemaSQL(
+                _schema.GET_GREATER_VERSIONS_OF_TYPE,
+                [actualType.typeName, actualType.schemaVersion])
+        if greaterVersions:
             raise RuntimeError(
                 "Greater versions of database %r objects in the DB than in memory" %
                 (actualType.typeName,))
@@ -1423,14 +1834,13 @@ class Store(Empowered):
         """
         while self._oldTypesRemaining:
             t0 = self._oldTypesRemaining[0]
-            onething = list(self.query(t0, limit=1))
-            if not onething:
+            o = self.findFirst(t0)
+            if o is None:
                 self._oldTypesRemaining.pop(0)
                 if self._anyUpgradesThisTypeYet:
                     log.msg("%s finished upgrading %s" % (self.dbdir.path, qual(t0)))
                 self._anyUpgradesThisTypeYet = False
                 continue
-            o = onething[0]
             self._anyUpgradesThisTypeYet = True
             self.transact(upgrade.upgradeAllTheWay, o)
             return True
@@ -1474,7 +1884,9 @@ class Store(Empowered):
 
         @param default: value to use if the item is not found.
         """
-        results = list(self.query(tableClass, comparison, limit=2))
+        results = self._findFast(tableClass, comparison, 2)
+        if results is None:
+            results = list(self.query(tableClass, comparison, limit=2))
         lr = len(results)
 
         if lr == 0:
@@ -1516,10 +1928,130 @@ class Store(Empowered):
         """
 
         limit = 1
+        if offset is None and sort is None:
+            results = self._findFast(tableClass, comparison, limit)
+            if results is not None:
+                if results:
+                    return results[0]
+                return default
         for item in self.query(tableClass, comparison, limit, offset, sort):
             return item
         return default
 
+
+    # whether SQLite supports data_version, found out by the first
+    # _changeStamp
+    _hasDataVersion = None
+
+    def _changeStamp(self):
+        """
+        Return a value which differs from any previous one if the rows in this
+        store's database may have changed since, or C{None} if that can't be
+        determined.
+
+        Changes made through this store's own connection are counted by the
+        connection, and SQLite's C{data_version} (3.8.8 and later) changes
+        whenever another connection commits.
+        """
+        if self._hasDataVersion is False:
+            return None
+        version = self.querySQL('PRAGMA %s.data_version' % (self.databaseName,))
+        if not version:
+            # older SQLites return no rows, and won't start to later on
+            self._hasDataVersion = False
+            return None
+        self._hasDataVersion = True
+        return (self._changeGeneration, self.connection.totalChanges(),
+                version[0][0])
+
+
+    def _unlessChanged(self, cache, key, compute):
+        """
+        Compute something from the contents of the database, or reuse what was
+        computed for the same key last time if the database has not changed
+        since.
+
+        @param cache: a dictionary in which to remember results.
+        @param key: the key for this result in C{cache}.
+        @param compute: a callable taking no arguments which computes the
+        result with SQL.
+        """
+        if self._hasDataVersion is False:
+            # nothing can be reused, so don't pay for the stamp either
+            return compute()
+        # Items changed in memory are only written out by a checkpoint, and
+        # the stamp must reflect them.
+        if not self.autocommit:
+            self.checkpoint()
+        stamp = self._changeStamp()
+        if stamp is not None:
+            cached = cache.get(key)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+        result = compute()
+        if stamp is not None:
+            cache[key] = (stamp, result)
+        return result
+
+
+    def _findFast(self, tableClass, comparison, limit):
+        """
+        Load the first C{limit} items of C{tableClass} matching C{comparison}
+        without building a new L{ItemQuery} for it, if the comparison allows.
+
+        Comparisons may provide a C{signature} method returning a hashable
+        description of everything about them except the values they compare
+        against (or C{None} if they can't).  The SQL for a single-table query
+        with a given type, signature and limit is generated by an L{ItemQuery}
+        the first time it is needed and kept in C{_fastLookupSQL}; afterwards
+        only the comparison's arguments are computed.
+
+        @return: a list of items, or C{None} if C{comparison} does not support
+        this and the caller should make a query instead.
+        """
+        if comparison is None:
+            signature = None
+        else:
+            getSignature = getattr(comparison, 'signature', None)
+            if getSignature is None:
+                return None
+            signature = getSignature()
+            if signature is None:
+                return None
+        key = (tableClass, signature, limit)
+        try:
+            plan = self._fastLookupSQL[key]
+        except KeyError:
+            query = ItemQuery(self, tableClass, comparison, limit)
+            if comparison is None:
+                singleTable = True
+            else:
+                tables = comparison.getInvolvedTables()
+                singleTable = len(tables) == 1 and tables[0] is tableClass
+            if not singleTable:
+                plan = None
+            else:
+                plan = (query._sqlAndArgs('SELECT', query._queryTarget)[0],
+                        query._massageData, query.locateCallSite)
+            self._fastLookupSQL[key] = plan
+        if plan is None:
+            return None
+        sqlstr, massage, locateCallSite = plan
+
+        t = time.time()
+        if not self.autocommit:
+            self.checkpoint()
+        if comparison is None:
+            args = []
+        else:
+            args = comparison.getArgs(self)
+        results = [massage(row) for row in self.querySQL(sqlstr, args)]
+        if statsObserved():
+            log.msg(interface=iaxiom.IStatEvent,
+                    querySite=locateCallSite(), queryTime=time.time() - t,
+                    querySQL=sqlstr)
+        return results
+
     def query(self, tableClass, comparison=None,
               limit=None, offset=None, sort=None):
         """
@@ -1605,38 +2137,78 @@ class Store(Empowered):
 
         @return: None.
         """
-        class FakeItem:
-            pass
-        _NEEDS_DEFAULT = object() # token for lookup failure
-        fakeOSelf = FakeItem()
-        fakeOSelf.store = self
+        self.transact(self._batchInsert, itemType, itemAttributes, dataRows)
+
+
+    def _batchInsert(self, itemType, itemAttributes, dataRows):
+        fakeOSelf = self._fakeItemForFilter
         sql = itemType._baseInsertSQL(self)
+        typeID = self.getTypeID(itemType)
         indices = {}
-        schema = [attr for (name, attr) in itemType.getSchema()]
         for i, attr in enumerate(itemAttributes):
             indices[attr] = i
-        for row in dataRows:
-            oid = self.store.executeSchemaSQL(
-                _schema.CREATE_OBJECT, [self.store.getTypeID(itemType)])
-            insertArgs = [oid]
-            for attr in schema:
-                i = indices.get(attr, _NEEDS_DEFAULT)
-                if i is _NEEDS_DEFAULT:
-                    pyval = attr.default
+        # For each column: its converter, the index of its value in a data
+        # row (None if it takes its default), and its default.
+        plan = [(attr._convertPyval, indices.get(attr), attr.default)
+                for (name, attr) in itemType.getSchema()]
+        width = len(itemAttributes)
+        dataRows = iter(dataRows)
+        while True:
+            chunk = list(itertools.islice(dataRows, BATCH_INSERT_ROWS))
+            if not chunk:
+                break
+            # Work a column at a time rather than a row at a time, so that
+            # each converter is looked up once per chunk instead of once per
+            # value, and a default is converted only once.
+            columns = zip(*chunk)
+            if len(columns) < width:
+                raise IndexError("Data row shorter than itemAttributes: %r"
+                                 % (min(chunk, key=len),))
+            converted = []
+            for convert, i, default in plan:
+                if i is None:
+                    converted.append([convert(fakeOSelf, default)] * len(chunk))
                 else:
-                    pyval = row[i]
-                dbval = attr._convertPyval(fakeOSelf, pyval)
-                insertArgs.append(dbval)
-            self.executeSQL(sql, insertArgs)
+                    converted.append([convert(fakeOSelf, value)
+                                      for value in columns[i]])
+            self._insertRows(sql, typeID, len(chunk), converted)
+
+
+    def _insertRows(self, sql, typeID, count, columns):
+        """
+        Allocate storeIDs for some rows of a single item type and insert them.
+
+        This must be called in a transaction: the storeIDs are allocated
+        together, relying on SQLite numbering the rows inserted into
+        axiom_objects consecutively, which holds as long as nothing else can
+        write to it in between.
+
+        @param sql: the INSERT statement for the item type.
+        @param typeID: the type ID of the item type.
+        @param count: the number of rows to insert.
+        @param columns: a list of lists of C{count} arguments for C{sql}, one
+        for each of its columns after the storeID.
+        """
+        first = self.executeSchemaSQL(_schema.CREATE_OBJECT, [typeID])
+        if count > 1:
+            self.executeManySQL(
+                self._schemaSQL(_schema.CREATE_OBJECT),
+                [[typeID]] * (count - 1))
+            last = self.querySQL('SELECT last_insert_rowid()')[0][0]
+            if last != first + count - 1:
+                raise RuntimeError(
+                    "Allocated storeIDs %d to %d for %d items" % (
+                        first, last, count))
+        self.executeManySQL(sql, zip(xrange(first, first + count), *columns))
 
     def _loadedItem(self, itemClass, storeID, attrs):
-        if self.objectCache.has(storeID):
-            result = self.objectCache.get(storeID)
-            # XXX do checks on consistency between attrs and DB object, maybe?
-        else:
+        result = self.objectCache.lookup(storeID)
+        # XXX do checks on consistency between attrs and DB object, maybe?
+        if result is None:
             result = itemClass.existingInStore(self, storeID, attrs)
             if not result.__legacy__:
                 self.objectCache.cache(storeID, result)
+            self._rememberType(storeID, result)
         return result
 
 
@@ -1648,20 +2220,41 @@ class Store(Empowered):
             self.touched.add(item)
 
 
+    _pendingWrites = None
     def checkpoint(self):
         self._rejectChanges += 1
+        # Items being checkpointed leave their INSERT and UPDATE statements
+        # here rather than running them, so that all the ones writing the same
+        # columns of the same table can be run with a single executemany,
+        # whatever order the touched items come in.  Each touched item is only
+        # checkpointed once, and these statements only affect the row of
+        # their own item, so running them after the DELETEs of the other items
+        # makes no difference to the outcome.
+        self._pendingWrites = {}
         try:
-            for item in self.touched:
-                # XXX: it should be possible here, using various clever hacks, to
-                # automatically optimize functionally identical statements into
-                # executemany.
-                item.checkpoint()
+            try:
+                for item in self.touched:
+                    item.checkpoint()
+                pendingWrites = self._pendingWrites
+            finally:
+                self._pendingWrites = None
+            # Items are only marked as written once their statements have run,
+            # so if one fails, the items it was for stay dirty and touched and
+            # are written again by the next checkpoint.
+            for sql, writes in pendingWrites.iteritems():
+                if len(writes) == 1:
+                    self.executeSQL(sql, writes[0][1])
+                else:
+                    self.executeManySQL(sql, [args for (item, args) in writes])
+                for item, args in writes:
+                    item._written()
             self.touched.clear()
         finally:
             self._rejectChanges -= 1
 
     executedThisTransaction = None
     tablesCreatedThisTransaction = None
+    _createdThisTransaction = False
 
     def transact(self, f, *a, **k):
         if self.transaction is not None:
@@ -1699,11 +2292,17 @@ class Store(Empowered):
         if self.debug:
             print '<'*10, 'BEGIN', '>'*10
         self.cursor.execute("BEGIN IMMEDIATE TRANSACTION")
+        self._changesAtBegin = self.connection.totalChanges()
         self._setupTxnState()
 
     def _setupTxnState(self):
+        for store in (self,) + self._attachedDescendants:
+            store._setupStoreTxnState()
+
+    def _setupStoreTxnState(self):
         self.executedThisTransaction = []
         self.tablesCreatedThisTransaction = []
+        self._createdThisTransaction = False
         if self.attachedToParent:
             self.transaction = self.parent.transaction
             self.touched = self.parent.touched
@@ -1711,18 +2310,35 @@ class Store(Empowered):
             self.transaction = set()
             self.touched = set()
         self.autocommit = False
-        for sub in self._attachedChildren.values():
-            sub._setupTxnState()
 
     def _commit(self):
         if self.debug:
             print '*'*10, 'COMMIT', '*'*10
         # self.connection.commit()
-        self.cursor.execute("COMMIT")
-        log.msg(interface=iaxiom.IStatEvent, stat_commits=1)
+        if (self.connection.totalChanges() == self._changesAtBegin
+            and not self._createdAnything()):
+            # Nothing was written; ending the transaction this way spares
+            # SQLite the work of committing it.
+            self.cursor.execute("ROLLBACK")
+        else:
+            self.cursor.execute("COMMIT")
+        if statsObserved():
+            log.msg(interface=iaxiom.IStatEvent, stat_commits=1)
         self._postCommitHook()
 
 
+    def _createdAnything(self):
+        """
+        Determine whether this store or any attached to it has created a table
+        or index during the current transaction.  These do not count towards
+        L{Connection.totalChanges}.
+        """
+        for store in (self,) + self._attachedDescendants:
+            if store._createdThisTransaction:
+                return True
+        return False
+
+
     def _postCommitHook(self):
         self._rejectChanges += 1
         try:
@@ -1737,7 +2353,8 @@ class Store(Empowered):
             print '>'*10, 'ROLLBACK', '<'*10
         # self.connection.rollback()
         self.cursor.execute("ROLLBACK")
-        log.msg(interface=iaxiom.IStatEvent, stat_rollbacks=1)
+        if statsObserved():
+            log.msg(interface=iaxiom.IStatEvent, stat_rollbacks=1)
 
 
     def revert(self):
@@ -1746,6 +2363,15 @@ class Store(Empowered):
 
 
     def _inMemoryRollback(self):
+        for store in (self,) + self._attachedDescendants:
+            store._inMemoryStoreRollback()
+
+
+    def _inMemoryStoreRollback(self):
+        # Rolled back changes still count towards the connection's total, so
+        # without this results computed since the transaction began could not
+        # be told apart from current ones by _changeStamp.
+        self._changeGeneration += 1
         self._rejectChanges += 1
         try:
             for item in self.transaction:
@@ -1753,34 +2379,41 @@ class Store(Empowered):
         finally:
             self._rejectChanges -= 1
         self.transaction.clear()
-        for tableClass in self.tablesCreatedThisTransaction:
+        created = self.tablesCreatedThisTransaction
+        for tableClass in created:
             del self.typenameAndVersionToID[tableClass.typeName,
                                             tableClass.schemaVersion]
             # Clear all cache related to this table
             for cache in (self.typeToInsertSQLCache,
                           self.typeToDeleteSQLCache,
                           self.typeToSelectSQLCache,
-                          self.typeToTableNameCache) :
-                if tableClass in cache:
-                    del cache[tableClass]
-            if tableClass.storeID in self.attrToColumnNameCache:
-                del self.attrToColumnNameCache[tableClass.storeID]
-            for name, attr in tableClass.getSchema():
-                if attr in self.attrToColumnNameCache:
-                    del self.attrToColumnNameCache[attr]
-
-        for sub in self._attachedChildren.values():
-            sub._inMemoryRollback()
+                          self.typeToTableNameCache,
+                          self.typeToQueryTargetCache) :
+                cache.pop(tableClass, None)
+            for attr in self._columnNamesCachedFor.pop(tableClass, ()):
+                self.attrToColumnNameCache.pop(attr, None)
+        if created:
+            # These are keyed on several tables at once; look through them
+            # once for all the new tables, rather than once for each.
+            created = set(created)
+            for tables in self.tablesToFromClauseCache.keys():
+                if created.intersection(tables):
+                    del self.tablesToFromClauseCache[tables]
+            for key in self._fastLookupSQL.keys():
+                if key[0] in created:
+                    del self._fastLookupSQL[key]
 
 
     def _cleanupTxnState(self):
+        for store in (self,) + self._attachedDescendants:
+            store._cleanupStoreTxnState()
+
+    def _cleanupStoreTxnState(self):
         self.autocommit = True
         self.transaction = None
         self.touched = None
         self.executedThisTransaction = None
         self.tablesCreatedThisTransaction = []
-        for sub in self._attachedChildren.values():
-            sub._cleanupTxnState()
 
     def close(self, _report=True):
         self.cursor.close()
@@ -1796,8 +2429,8 @@ class Store(Empowered):
                 print 'exec:', self.avgms(self.execTimes)
 
     def avgms(self, l):
-        return 'count: %d avg: %dus' % (len(l),
-                                        int( (sum(l)/len(l)) * 1000000.),)
+        return 'count: %d avg: %dus' % (l.count,
+                                        int( (l.total/l.count) * 1000000.),)
 
     def _indexNameOf(self, tableClass, attrname):
         return "%s.axiomidx_%s_v%d_%s" % (self.databaseName,
@@ -1820,13 +2453,18 @@ class Store(Empowered):
 
         @return: a string
         """
+        try:
+            # Only Item subclasses ever make it into the cache, so a hit needs
+            # no further checking.  TypeError covers unhashable garbage.
+            return self.typeToTableNameCache[tableClass]
+        except (KeyError, TypeError):
+            pass
         if not (isinstance(tableClass, type) and issubclass(tableClass, item.Item)):
             raise errors.ItemClassesOnly("Only subclasses of Item have table names.")
 
-        if tableClass not in self.typeToTableNameCache:
-            self.typeToTableNameCache[tableClass] = self._tableNameFor(tableClass.typeName, tableClass.schemaVersion)
-            # make sure the table exists
-            self.getTypeID(tableClass)
+        self.typeToTableNameCache[tableClass] = self._tableNameFor(tableClass.typeName, tableClass.schemaVersion)
+        # make sure the table exists
+        self.getTypeID(tableClass)
         return self.typeToTableNameCache[tableClass]
 
 
@@ -1863,11 +2501,17 @@ class Store(Empowered):
 
         @return: a string
         """
-        if attribute not in self.attrToColumnNameCache:
-            self.attrToColumnNameCache[attribute] = '.'.join(
-                (self.getTableName(attribute.type),
-                 self.getShortColumnName(attribute)))
-        return self.attrToColumnNameCache[attribute]
+        try:
+            return self.attrToColumnNameCache[attribute]
+        except KeyError:
+            # Interned, since these end up in the keys of the statement and
+            # SQL caches, and are compared against each other there.
+            name = self.attrToColumnNameCache[attribute] = intern('%s.%s' % (
+                self.getTableName(attribute.type),
+                self.getShortColumnName(attribute)))
+            self._columnNamesCachedFor.setdefault(
+                attribute.type, []).append(attribute)
+            return name
 
 
     def getTypeID(self, tableClass):
@@ -1906,29 +2550,21 @@ class Store(Empowered):
         existing one if the table was created by another Store object
         referencing this database.
         """
-        sqlstr = []
-        sqlarg = []
-
         # needs to be calculated including version
         tableName = self._tableNameFor(tableClass.typeName,
                                        tableClass.schemaVersion)
 
-        sqlstr.append("CREATE TABLE %s (" % tableName)
-
-        for nam, atr in tableClass.getSchema():
-            # it's a stored attribute
-            sqlarg.append("\n%s %s" %
-                          (atr.getShortColumnName(self), atr.sqltype))
-
-        if len(sqlarg) == 0:
+        schema = list(tableClass.getSchema())
+        if not schema:
             # XXX should be raised way earlier, in the class definition or something
             raise NoEmptyItems("%r did not define any attributes" % (tableClass,))
 
-        sqlstr.append(', '.join(sqlarg))
-        sqlstr.append(')')
+        columns = ', '.join([
+                "\n%s %s" % (atr.getShortColumnName(self), atr.sqltype)
+                for nam, atr in schema])
 
         try:
-            self.createSQL(''.join(sqlstr))
+            self.createSQL("CREATE TABLE %s (%s)" % (tableName, columns))
         except errors.TableAlreadyExists:
             # Although we don't have a memory of this table from the last time
             # we called "_startup()", another process has updated the schema
@@ -1949,15 +2585,15 @@ class Store(Empowered):
 
         self._createIndexesFor(tableClass)
 
-        for n, (name, storedAttribute) in enumerate(tableClass.getSchema()):
-            self.executeSchemaSQL(
-                _schema.ADD_SCHEMA_ATTRIBUTE,
-                [typeID, n, storedAttribute.indexed, storedAttribute.sqltype,
-                 storedAttribute.allowNone, storedAttribute.attrname,
-                 storedAttribute.doc, storedAttribute.__class__.__name__])
-            # XXX probably need something better for pythontype eventually,
-            # when we figure out a good way to do user-defined attributes or we
-            # start parameterizing references.
+        self.executeManySQL(
+            self._schemaSQL(_schema.ADD_SCHEMA_ATTRIBUTE),
+            [[typeID, n, storedAttribute.indexed, storedAttribute.sqltype,
+              storedAttribute.allowNone, storedAttribute.attrname,
+              storedAttribute.doc, storedAttribute.__class__.__name__]
+             for n, (name, storedAttribute) in enumerate(schema)])
+        # XXX probably need something better for pythontype eventually,
+        # when we figure out a good way to do user-defined attributes or we
+        # start parameterizing references.
 
         return typeID
 
@@ -1977,25 +2613,24 @@ class Store(Empowered):
 
         indexColumnPrefix = '.'.join(self.getTableName(tableClass).split(".")[1:])
 
+        # Not executescript(): PySQLite commits the current transaction
+        # before running a script, and these must be created within it.
         for (indexColumns, indexAttrs) in indexes:
-            csql = ('CREATE INDEX %s ON %s(%s)' %
+            csql = ('CREATE INDEX IF NOT EXISTS %s ON %s(%s)' %
                     (self._indexNameOf(tableClass, indexAttrs),
                      indexColumnPrefix,
                      ', '.join(indexColumns)))
-            try:
-                self.createSQL(csql)
-            except errors.SQLError, sqle:
-                # Ignore duplicate indexes.
-                if "already exists" not in str(sqle):
-                    raise
+            self.createSQL(csql)
 
 
     def getTableQuery(self, typename, version):
-        if (typename, version) not in self.tableQueries:
-            query = 'SELECT * FROM %s WHERE oid = ?' % (
-                self._tableNameFor(typename, version), )
+        try:
+            return self.tableQueries[typename, version]
+        except KeyError:
+            query = self._normalizeSQL('SELECT * FROM %s WHERE oid = ?' % (
+                self._tableNameFor(typename, version), ))
             self.tableQueries[typename, version] = query
-        return self.tableQueries[typename, version]
+            return query
 
 
     def getItemByID(self, storeID, default=_noItem, autoUpgrade=True):
@@ -2034,72 +2669,191 @@ class Store(Empowered):
                     type(storeID).__name__,))
         if storeID == -1:
             return self
-        if self.objectCache.has(storeID):
-            return self.objectCache.get(storeID)
-        log.msg(interface=iaxiom.IStatEvent, stat_cache_misses=1, key=storeID)
-        results = self.querySchemaSQL(_schema.TYPEOF_QUERY, [storeID])
+        result = self.objectCache.lookup(storeID)
+        if result is not None:
+            return result
+        if statsObserved():
+            log.msg(interface=iaxiom.IStatEvent, stat_cache_misses=1,
+                    key=storeID)
+        # Both of these statements are already normalized, so they go
+        # straight to the cursor, where SQLite's statement cache has them
+        # prepared.
+        if self.debug:
+            query = self.querySQL
+        else:
+            query = self._queryandfetch
+        known = self._storeIDTypeCache.get(storeID)
+        if known is not None:
+            # This item was loaded before, so its row is most likely still in
+            # the same table; if it isn't, the item has been deleted or
+            # upgraded since, and we look up its type again.
+            typename, version = known
+            attrs = query(self.getTableQuery(typename, version), [storeID])
+            if attrs:
+                return self._itemFromRow(storeID, typename, version,
+                                         attrs[0], autoUpgrade)
+            del self._storeIDTypeCache[storeID]
+        results = query(self._schemaSQL(_schema.TYPEOF_QUERY), [storeID])
         assert (len(results) in [1, 0]),\
             "Database panic: more than one result for TYPEOF!"
         if results:
             typename, module, version = results[0]
             # for the moment we're going to assume no inheritance
-            attrs = self.querySQL(self.getTableQuery(typename, version),
-                                  [storeID])
+            attrs = query(self.getTableQuery(typename, version), [storeID])
             if len(attrs) != 1:
                 if default is _noItem:
                     raise errors.ItemNotFound("No results for known-to-be-good object")
                 return default
-            attrs = attrs[0]
-            useMostRecent = False
-            moreRecentAvailable = False
-
-            # The schema may have changed since the last time I saw the
-            # database.  Let's look to see if this is suspiciously broken...
-
-            if _typeIsTotallyUnknown(typename, version):
-                # Another process may have created it - let's re-up the schema
-                # and see what we get.
-                self._startup()
-
-                # OK, all the modules have been loaded now, everything
-                # verified.
-                if _typeIsTotallyUnknown(typename, version):
-
-                    # If there is STILL no inkling of it anywhere, we are
-                    # almost certainly boned.  Let's tell the user in a
-                    # structured way, at least.
-                    raise errors.UnknownItemType(
-                        "cannot load unknown schema/version pair: %r %r - id: %r" %
-                        (typename, version, storeID))
-
-            if typename in _typeNameToMostRecentClass:
-                moreRecentAvailable = True
-                mostRecent = _typeNameToMostRecentClass[typename]
-
-                if mostRecent.schemaVersion < version:
-                    raise RuntimeError("%s:%d - was found in the database and most recent %s is %d" %
-                                       (typename, version, typename, mostRecent.schemaVersion))
-                if mostRecent.schemaVersion == version:
-                    useMostRecent = True
-            if useMostRecent:
-                T = mostRecent
-            else:
-                T = self.getOldVersionOf(typename, version)
-            x = T.existingInStore(self, storeID, attrs)
-            if moreRecentAvailable and (not useMostRecent) and autoUpgrade:
-                # upgradeVersion will do caching as necessary, we don't have to
-                # cache here.  (It must, so that app code can safely call
-                # upgradeVersion and get a consistent object out of it.)
-                x = self.transact(upgrade.upgradeAllTheWay, x)
-            elif not x.__legacy__:
-                # We loaded the most recent version of an object
-                self.objectCache.cache(storeID, x)
-            return x
+            return self._itemFromRow(storeID, typename, version, attrs[0],
+                                     autoUpgrade)
         if default is _noItem:
             raise KeyError(storeID)
         return default
 
 
+    def getItemsByID(self, storeIDs, default=_noItem, autoUpgrade=True):
+        """
+        Retrieve several items by their storeIDs.
+
+        This is equivalent to calling L{getItemByID} for each storeID, but the
+        items which are not already loaded are fetched from the database with
+        one query for each item type involved, rather than two queries each.
+
+        @param storeIDs: an iterable of L{int}s which refer to the store.
+
+        @param default: as for L{getItemByID}.
+
+        @param autoUpgrade: as for L{getItemByID}.
+
+        @raise TypeError: if any storeID is not an integer.
+
+        @raise KeyError: if no item corresponded to some storeID and no
+        default was given.
+
+        @return: a list of the items, or of C{default} in place of any which
+        could not be found, in the order of C{storeIDs}.
+        """
+        storeIDs = list(storeIDs)
+        missing = []
+        seen = set()
+        for storeID in storeIDs:
+            if not isinstance(storeID, (int, long)):
+                raise TypeError("storeID *must* be an int or long, not %r" % (
+                        type(storeID).__name__,))
+            if (storeID != -1 and storeID not in seen
+                    and not self.objectCache.has(storeID)):
+                seen.add(storeID)
+                missing.append(storeID)
+
+        loaded = {}
+        for start in xrange(0, len(missing), BATCH_LOAD_ROWS):
+            chunk = missing[start:start + BATCH_LOAD_ROWS]
+            byType = {}
+            unknown = []
+            for storeID in chunk:
+                # Items of remembered types which are no longer in their
+                # tables are left for getItemByID to sort out below.
+                known = self._storeIDTypeCache.get(storeID)
+                if known is None:
+                    unknown.append(storeID)
+                else:
+                    byType.setdefault(known, []).append(storeID)
+            if unknown:
+                unknown = _padStoreIDs(unknown)
+                for storeID, typename, version in self.querySQL(
+                    self._schemaSQL(_schema.TYPESOF_QUERY) % (
+                        ', '.join(['?'] * len(unknown)),), unknown):
+                    byType.setdefault((typename, version), []).append(storeID)
+            for (typename, version), typeIDs in byType.iteritems():
+                typeIDs = _padStoreIDs(typeIDs)
+                rows = self.querySQL(
+                    'SELECT oid, * FROM %s WHERE oid IN (%s)' % (
+                        self._tableNameFor(typename, version),
+                        ', '.join(['?'] * len(typeIDs))),
+                    typeIDs)
+                for row in rows:
+                    storeID = row[0]
+                    # Upgrading an earlier item may have loaded this one.
+                    item = self.objectCache.lookup(storeID)
+                    if item is None:
+                        item = self._itemFromRow(
+                            storeID, typename, version, row[1:], autoUpgrade)
+                    loaded[storeID] = item
+
+        result = []
+        for storeID in storeIDs:
+            if storeID in loaded:
+                result.append(loaded[storeID])
+            else:
+                # Loaded already, the store itself, or not there at all.
+                result.append(self.getItemByID(storeID, default, autoUpgrade))
+        return result
+
+
+    def _itemFromRow(self, storeID, typename, version, attrs, autoUpgrade):
+        """
+        Create an item from its row in its type's table, upgrading it if
+        necessary and C{autoUpgrade} is true.
+        """
+        # The schema may have changed since the last time I saw the
+        # database.  Let's look to see if this is suspiciously broken...
+
+        if _typeIsTotallyUnknown(typename, version):
+            # Another process may have created it - let's re-up the schema
+            # and see what we get.
+            self._startup()
+
+            # OK, all the modules have been loaded now, everything
+            # verified.
+            if _typeIsTotallyUnknown(typename, version):
+
+                # If there is STILL no inkling of it anywhere, we are
+                # almost certainly boned.  Let's tell the user in a
+                # structured way, at least.
+                raise errors.UnknownItemType(
+                    "cannot load unknown schema/version pair: %r %r - id: %r" %
+                    (typename, version, storeID))
+
+        mostRecent = _typeNameToMostRecentClass.get(typename)
+        moreRecentAvailable = mostRecent is not None
+        if moreRecentAvailable:
+            mostRecentVersion = mostRecent.schemaVersion
+            if mostRecentVersion < version:
+                raise RuntimeError("%s:%d - was found in the database and most recent %s is %d" %
+                                   (typename, version, typename, mostRecentVersion))
+            useMostRecent = mostRecentVersion == version
+        else:
+            useMostRecent = False
+        if useMostRecent:
+            T = mostRecent
+        else:
+            T = self.getOldVersionOf(typename, version)
+        x = T.existingInStore(self, storeID, attrs)
+        if moreRecentAvailable and (not useMostRecent) and autoUpgrade:
+            # upgradeVersion will do caching as necessary, we don't have to
+            # cache here.  (It must, so that app code can safely call
+            # upgradeVersion and get a consistent object out of it.)
+            x = self.transact(upgrade.upgradeAllTheWay, x)
+        elif not x.__legacy__:
+            # We loaded the most recent version of an object
+            self.objectCache.cache(storeID, x)
+        self._rememberType(storeID, x)
+        return x
+
+
+    def _rememberType(self, storeID, item):
+        """
+        Remember the type of an item loaded from the database, so that
+        L{getItemByID} can go straight to its table if it has to load it again.
+        """
+        cache = self._storeIDTypeCache
+        if len(cache) >= STOREID_TYPE_CACHE_SIZE:
+            # Cheaper than keeping track of which entries were least recently
+            # used, and the ones that matter will soon be back.
+            cache.clear()
+        cache[storeID] = (item.typeName, item.schemaVersion)
+
+
     def _normalizeSQL(self, sql):
         # It turns out that "ATTACH DATABASE" *requires* string interpolation,
         # since it syntactically does not support bind parameters.  It takes a
@@ -2108,22 +2862,36 @@ class Store(Empowered):
         # wish there were a way to preserve 'paranoid mode'
 
         # assert "'" not in sql, "Strings are _NOT ALLOWED_"
-        if sql not in self.statementCache:
-            accum = []
-            lines = sql.split('\n')
-            for line in lines:
-                line = line.split('--')[0]         # remove comments
-                words = line.strip().split()
-                accum.extend(words)
-            normsql = ' '.join(accum)   # your SQL should never have any
-                                        # significant whitespace in it, right?
+        try:
+            return self.statementCache[sql]
+        except KeyError:
+            # your SQL should never have any significant whitespace in it,
+            # right?
+            normsql = ' '.join(_sqlComment.sub('', sql).split())
+            if type(normsql) is str:
+                # The same few statements are executed over and over; keep a
+                # single copy of each, so comparing them is a pointer check.
+                normsql = intern(normsql)
             self.statementCache[sql] = normsql
-        return self.statementCache[sql]
+            return normsql
+
+
+    def _schemaSQL(self, sql):
+        """
+        Substitute this store's database name into a statement from
+        L{_schema} and normalize the result.
+        """
+        try:
+            return self._schemaSQLCache[sql]
+        except KeyError:
+            normsql = self._normalizeSQL(
+                sql.replace("*DATABASE*", self.databaseName))
+            self._schemaSQLCache[sql] = normsql
+            return normsql
 
 
     def querySchemaSQL(self, sql, args=()):
-        sql = sql.replace("*DATABASE*", self.databaseName)
-        return self.querySQL(sql, args)
+        return self.querySQL(self._schemaSQL(sql), args)
 
 
     def querySQL(self, sql, args=()):
@@ -2137,20 +2905,46 @@ class Store(Empowered):
         return result
 
 
-    def _queryandfetch(self, sql, args):
+    def querySQLCursor(self, sql, args=()):
+        """For use with SELECT statements whose results should be consumed
+        incrementally.
+
+        The statement is run on a cursor of its own, so that other statements
+        may be issued while its results are being read.  That cursor is not
+        explicitly closed (for APSW, closing a cursor closes its connection);
+        it is released along with the returned iterator.
+
+        @return: an iterator over the result rows.
+        """
+        sql = self._normalizeSQL(sql)
         if self.debug:
             print '**', sql, '--', ', '.join(map(str, args))
-        self.cursor.execute(sql, args)
+        cursor = self.connection.cursor()
+        cursor.execute(sql, args)
+        return iter(cursor)
+
+
+    def _queryandfetch(self, sql, args):
+        if self.debug:
+            return self._queryandfetchDebug(sql, args)
+        cursor = self.cursor
+        cursor.execute(sql, args)
+        return cursor.fetchall()
+
+
+    def _queryandfetchDebug(self, sql, args):
+        print '**', sql, '--', ', '.join(map(str, args))
+        cursor = self.cursor
+        cursor.execute(sql, args)
         before = time.time()
-        result = list(self.cursor)
+        result = cursor.fetchall()
         after = time.time()
         if after - before > 2.0:
-            log.msg('Extremely long list(cursor): %s' % (after - before,))
+            log.msg('Extremely long fetchall(): %s' % (after - before,))
             log.msg(sql)
             # import traceback; traceback.print_stack()
-        if self.debug:
-            print '  lastrow:', self.cursor.lastRowID()
-            print '  result:', result
+        print '  lastrow:', cursor.lastRowID()
+        print '  result:', result
         return result
 
 
@@ -2159,6 +2953,8 @@ class Store(Empowered):
         For use with auto-committing statements such as CREATE TABLE or CREATE
         INDEX.
         """
+        if self.transaction is not None:
+            self._createdThisTransaction = True
         before = time.time()
         self._execSQL(sql, args)
         after = time.time()
@@ -2179,8 +2975,7 @@ class Store(Empowered):
 
 
     def executeSchemaSQL(self, sql, args=()):
-        sql = sql.replace("*DATABASE*", self.databaseName)
-        return self.executeSQL(sql, args)
+        return self.executeSQL(self._schemaSQL(sql), args)
 
 
     def executeSQL(self, sql, args=()):
@@ -2193,6 +2988,20 @@ class Store(Empowered):
             self.executedThisTransaction.append((result, sql, args))
         return result
 
+
+    def executeManySQL(self, sql, argsList):
+        """
+        For use with UPDATE or INSERT statements which are to be run once for
+        each of a list of argument lists.
+        """
+        sql = self._normalizeSQL(sql)
+        if self.debug:
+            print '**', sql, '--', len(argsList), 'rows'
+        self.cursor.executemany(sql, argsList)
+        if self.executedThisTransaction is not None:
+            self.executedThisTransaction.extend(
+                [(None, sql, args) for args in argsList])
+
 # This isn't actually useful any more.  It turns out that the pysqlite
 # documentation is confusingly worded; it's perfectly possible to create tables
 # within transactions, but PySQLite's automatic transaction management (which
@@ -2215,6 +3024,32 @@ class Store(Empowered):
 #                         resultThisTime))
 
 
+class _Timings(object):
+    """
+    The number and total duration of some timed operations.
+
+    Only the average is ever reported, so the individual times are not kept:
+    a debugging store can run for any number of statements without its
+    timings growing.
+
+    @ivar count: the number of operations timed.
+    @ivar total: their total duration, in seconds.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+
+
+    def __len__(self):
+        return self.count
+
+
+    def append(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+
+
+
 def timeinto(l, f, *a, **k):
     then = time.time()
     try:
@@ -2224,5 +3059,5 @@ def timeinto(l, f, *a, **k):
         elapsed = now - then
         l.append(elapsed)
 
-queryTimes = []
-execTimes = []
+queryTimes = _Timings()
+execTimes = _Timings()
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2007  Vodafone España, S.A.
+# Author:  Pablo Martí
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Tests for the bundled axiom store
+"""
+__version__ = "$Rev: 1172 $"
+
+from twisted.trial import unittest
+
+from vmc.contrib.axiom.store import Store, BATCH_LOAD_ROWS
+from vmc.contrib.axiom.item import Item
+from vmc.contrib.axiom.attributes import integer, reference
+
+class Parent(Item):
+    typeName = 'vmc_test_axiom_parent'
+    schemaVersion = 1
+    n = integer()
+
+class Child(Item):
+    typeName = 'vmc_test_axiom_child'
+    schemaVersion = 1
+    parent = reference(whenDeleted=reference.CASCADE)
+
+class Watcher(Item):
+    typeName = 'vmc_test_axiom_watcher'
+    schemaVersion = 1
+    child = reference(whenDeleted=reference.NULLIFY)
+
+
+class TestQueryDeleteFromStore(unittest.TestCase):
+    """Tests for ItemQuery.deleteFromStore"""
+
+    def setUp(self):
+        self.store = Store()
+        self.parent = Parent(store=self.store, n=1)
+        self.childIDs = [Child(store=self.store, parent=self.parent).storeID
+                            for i in range(3)]
+
+    def test_cascade_to_loaded_dependents(self):
+        """
+        Test that loaded dependents are gone after a cascaded query delete
+        """
+        children = map(self.store.getItemByID, self.childIDs)
+        watcher = Watcher(store=self.store, child=children[0])
+
+        self.store.query(Parent).deleteFromStore()
+
+        self.assertEqual(self.store.query(Child).count(), 0)
+        for storeID in self.childIDs:
+            self.assertRaises(KeyError, self.store.getItemByID, storeID)
+        self.assertIdentical(watcher.child, None)
+
+    def test_cascade_to_unloaded_dependents(self):
+        """
+        Test that dependents which are not loaded are deleted too
+        """
+        self.store.query(Parent).deleteFromStore()
+
+        self.assertEqual(self.store.query(Child).count(), 0)
+        for storeID in self.childIDs:
+            self.assertRaises(KeyError, self.store.getItemByID, storeID)
+
+
+class WriteFailed(Exception):
+    """Raised by a store whose next INSERT or UPDATE fails"""
+
+
+class TestCheckpoint(unittest.TestCase):
+    """Tests for Store.checkpoint"""
+
+    def setUp(self):
+        self.store = Store()
+        self.parent = Parent(store=self.store, n=1)
+
+    def fail_next_write(self, verb):
+        """
+        Makes the next C{verb} statement run by the store raise WriteFailed
+        """
+        executeSQL = self.store.executeSQL
+        def failingExecuteSQL(sql, args=()):
+            if sql.startswith(verb):
+                del self.store.executeSQL
+                raise WriteFailed()
+            return executeSQL(sql, args)
+        self.store.executeSQL = failingExecuteSQL
+
+    def checkpoint_and_fail(self):
+        # queries checkpoint the store before they run
+        self.assertRaises(WriteFailed, self.store.query(Parent).count)
+
+    def test_failed_update_is_retried(self):
+        """
+        Test that an UPDATE that failed is run again when committing
+        """
+        def txn():
+            self.parent.n = 7
+            self.fail_next_write('UPDATE')
+            self.checkpoint_and_fail()
+        self.store.transact(txn)
+
+        self.assertEqual(self.store.query(Parent, Parent.n == 7).count(), 1)
+        self.assertEqual(self.store.query(Parent, Parent.n == 1).count(), 0)
+
+    def test_failed_insert_is_retried(self):
+        """
+        Test that an INSERT that failed is run again when committing
+        """
+        def txn():
+            other = Parent(store=self.store, n=2)
+            self.fail_next_write('INSERT')
+            self.checkpoint_and_fail()
+            return other
+        other = self.store.transact(txn)
+
+        self.assertEqual(self.store.query(Parent, Parent.n == 2).count(), 1)
+        self.assertIdentical(self.store.getItemByID(other.storeID), other)
+        other.n = 3
+        self.assertEqual(self.store.query(Parent, Parent.n == 3).count(), 1)
+
+
+class TestWithoutDataVersion(unittest.TestCase):
+    """Tests for result reuse on SQLites without PRAGMA data_version"""
+
+    def setUp(self):
+        self.store = Store()
+        for i in range(3):
+            Parent(store=self.store, n=i)
+        self.pragmas = []
+        querySQL = self.store.querySQL
+        def oldQuerySQL(sql, args=()):
+            if 'data_version' in sql:
+                # what SQLite before 3.8.8 answers
+                self.pragmas.append(sql)
+                return []
+            return querySQL(sql, args)
+        self.store.querySQL = oldQuerySQL
+
+    def test_results_are_computed_every_time(self):
+        """
+        Test that counts and aggregates follow changes to the store
+        """
+        query = self.store.query(Parent)
+        self.assertEqual(query.count(), 3)
+        self.assertEqual(query.getColumn('n').sum(), 3)
+        Parent(store=self.store, n=3)
+        self.assertEqual(query.count(), 4)
+        self.assertEqual(query.getColumn('n').sum(), 6)
+
+    def test_data_version_asked_once(self):
+        """
+        Test that data_version is only tried once per store
+        """
+        query = self.store.query(Parent)
+        for i in range(3):
+            query.count()
+            query.getColumn('n').max()
+        self.assertEqual(len(self.pragmas), 1)
+
+
+class TestGetItemsByID(unittest.TestCase):
+    """Tests for Store.getItemsByID"""
+
+    def setUp(self):
+        self.store = Store()
+        # items are dropped right away so they have to be loaded again
+        self.parentIDs = [Parent(store=self.store, n=i).storeID
+                            for i in range(5)]
+        self.missingID = max(self.parentIDs) + 1000
+
+    def test_same_as_get_item_by_id(self):
+        """
+        Test that items come back in the order of the storeIDs asked for
+        """
+        storeIDs = list(reversed(self.parentIDs))
+        items = self.store.getItemsByID(storeIDs)
+        self.assertEqual([item.storeID for item in items], storeIDs)
+        self.assertEqual([item.n for item in items], [4, 3, 2, 1, 0])
+        for item in items:
+            self.assertIdentical(item, self.store.getItemByID(item.storeID))
+
+    def test_missing_without_default(self):
+        """
+        Test that a missing storeID raises KeyError without a default
+        """
+        self.assertRaises(KeyError, self.store.getItemsByID,
+                          self.parentIDs + [self.missingID])
+
+    def test_missing_with_default(self):
+        """
+        Test that a missing storeID is replaced by the default
+        """
+        items = self.store.getItemsByID([self.missingID, self.parentIDs[0]],
+                                        default=None)
+        self.assertIdentical(items[0], None)
+        self.assertEqual(items[1].storeID, self.parentIDs[0])
+
+    def test_store_id(self):
+        """
+        Test that -1 refers to the store itself
+        """
+        self.assertEqual(self.store.getItemsByID([-1]), [self.store])
+
+    def test_duplicates(self):
+        """
+        Test that a repeated storeID gives the same item every time
+        """
+        storeID = self.parentIDs[2]
+        items = self.store.getItemsByID([storeID, storeID, storeID])
+        self.assertEqual(len(items), 3)
+        self.assertIdentical(items[0], items[1])
+        self.assertIdentical(items[1], items[2])
+
+    def test_already_loaded(self):
+        """
+        Test that items already in memory are returned as they are
+        """
+        loaded = self.store.getItemByID(self.parentIDs[1])
+        items = self.store.getItemsByID(self.parentIDs)
+        self.assertIdentical(items[1], loaded)
+
+    def test_not_integer(self):
+        """
+        Test that storeIDs must be integers
+        """
+        self.assertRaises(TypeError, self.store.getItemsByID, ['1'])
+
+    def test_more_than_a_batch(self):
+        """
+        Test that more items than fit in one batch are all loaded
+        """
+        storeIDs = [Parent(store=self.store, n=i).storeID
+                        for i in range(BATCH_LOAD_ROWS + 1)]
+        items = self.store.getItemsByID(storeIDs)
+        self.assertEqual([item.n for item in items],
+                         range(BATCH_LOAD_ROWS + 1))
+
+    def test_few_statement_sizes(self):
+        """
+        Test that looking up many lengths of lists adds few statements
+        """
+        storeIDs = [Parent(store=self.store, n=i).storeID for i in range(40)]
+        before = len(self.store.statementCache)
+        for length in range(1, 41):
+            self.store.getItemsByID(storeIDs[:length])
+            # a fresh type lookup for each length too
+            self.store._storeIDTypeCache.clear()
+        # a TYPESOF and a SELECT for each of 1, 2, 4, 8, 16, 32 and 64 ids,
+        # and the TYPESOF template they are made from
+        self.failUnless(len(self.store.statementCache) - before <= 15)
+
+    def test_stale_type_of_existing_item(self):
+        """
+        Test that a wrongly remembered type does not hide an item
+        """
+        storeID = self.parentIDs[0]
+        Child(store=self.store, parent=None)
+        self.store._storeIDTypeCache[storeID] = (Child.typeName,
+                                                 Child.schemaVersion)
+        items = self.store.getItemsByID([storeID])
+        self.failUnless(isinstance(items[0], Parent))
+        self.assertEqual(items[0].storeID, storeID)
+
+    def test_stale_type_of_deleted_item(self):
+        """
+        Test that the remembered type of a deleted item is not trusted
+        """
+        storeID = self.parentIDs[0]
+        self.store.getItemByID(storeID).deleteFromStore()
+        self.store._storeIDTypeCache[storeID] = (Parent.typeName,
+                                                 Parent.schemaVersion)
+        self.assertEqual(self.store.getItemsByID([storeID], default=None),
+                         [None])
+        self.assertRaises(KeyError, self.store.getItemsByID, [storeID])
+
+
+class TestQueryIteration(unittest.TestCase):
+    """Tests for BaseQuery.iterate and BaseQuery.iterBatches"""
+
+    def setUp(self):
+        self.store = Store()
+        for i in range(7):
+            Parent(store=self.store, n=i)
+        self.query = self.store.query(Parent, sort=Parent.n.ascending)
+
+    def test_iterate(self):
+        """
+        Test that iterate yields the same results as iterating the query
+        """
+        self.assertEqual([p.n for p in self.query.iterate()], range(7))
+        limited = self.store.query(Parent, sort=Parent.n.ascending, limit=3)
+        self.assertEqual([p.n for p in limited.iterate()], [0, 1, 2])
+
+    def test_iter_batches(self):
+        """
+        Test that no batch is larger than batchSize
+        """
+        batches = list(self.query.iterBatches(3))
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+        self.assertEqual([p.n for batch in batches for p in batch], range(7))
+
+    def test_iter_batches_exact(self):
+        """
+        Test that results filling the last batch give no empty batch
+        """
+        batches = list(self.query.iterBatches(7))
+        self.assertEqual([len(batch) for batch in batches], [7])
+
+    def test_iter_batches_single(self):
+        """
+        Test that a batchSize of one yields every result on its own
+        """
+        batches = list(self.query.iterBatches(1))
+        self.assertEqual(batches, [[p] for p in self.query])
+
+    def test_iter_batches_empty(self):
+        """
+        Test that an empty query yields no batches
+        """
+        query = self.store.query(Parent, Parent.n > 100)
+        self.assertEqual(list(query.iterBatches(3)), [])
+
+    def test_iter_batches_of_column(self):
+        """
+        Test that attribute queries can be iterated in batches too
+        """
+        column = self.query.getColumn('n')
+        self.assertEqual(list(column.iterBatches(4)),
+                         [[0, 1, 2, 3], [4, 5, 6]])
+
+
+class TestAggregates(unittest.TestCase):
+    """Tests for AttributeQuery.aggregates"""
+
+    def setUp(self):
+        self.store = Store()
+        for i in range(1, 5):
+            Parent(store=self.store, n=i)
+
+    def test_aggregates(self):
+        """
+        Test that aggregates agrees with the separate methods
+        """
+        column = self.store.query(Parent).getColumn('n')
+        self.assertEqual(column.aggregates(), (4, 10, 2.5, 1, 4))
+        self.assertEqual(column.aggregates(),
+                         (column.count(), column.sum(), column.average(),
+                          column.min(), column.max()))
+
+    def test_aggregates_of_empty_query(self):
+        """
+        Test that an empty query gives None for the minimum and maximum
+        """
+        column = self.store.query(Parent, Parent.n > 100).getColumn('n')
+        self.assertEqual(column.aggregates(), (0, 0, None, None, None))
+        self.assertEqual(column.count(), 0)
+        self.assertEqual(column.sum(), 0)
@@ -22,7 +22,9 @@ __version__ = "$Rev: 1172 $"
 from twisted.trial import unittest
 
 from vmc.common.middleware import BasicNetworkOperator
-from vmc.common.statem.networkreg import NetworkRegStateMachine
+from vmc.common.statem.networkreg import (NetworkRegStateMachine,
+                                          has_mode_hooks)
+from vmc.contrib.epsilon.modal import mode
 from vmc.common.notifications import NetworkRegNotification
 from stub import DeviceStub, DeferredNotification
 
@@ -149,3 +151,40 @@ class TestNetworkRegistrationSM(unittest.TestCase):
         # assert we're connected to Claro GPRS
         d.addCallback(lambda resp: self.assertEqual(resp, (72405, "GPRS")))
         return d
+
+
+class HookedNetworkRegStateMachine(NetworkRegStateMachine):
+    """NetworkRegStateMachine whose modes define __enter__/__exit__ hooks"""
+
+    class check_registered(mode):
+        def __exit__(self):
+            self.calls.append('exit check_registered')
+
+    class registration_finished(mode):
+        def __enter__(self):
+            self.calls.append('enter registration_finished')
+
+
+class TestNetworkRegTransitions(unittest.TestCase):
+    """Tests for NetworkRegStateMachine.transitionTo"""
+
+    def test_transition_without_hooks(self):
+        """
+        Test that a plain transition just switches the mode
+        """
+        self.failIf(has_mode_hooks(NetworkRegStateMachine))
+        sm = NetworkRegStateMachine(DeviceStub({}))
+        sm.transitionTo('registration_finished')
+        self.assertEqual(sm.mode, 'registration_finished')
+
+    def test_transition_runs_hooks_of_subclasses(self):
+        """
+        Test that hooks defined by a subclass' modes are still run
+        """
+        self.failUnless(has_mode_hooks(HookedNetworkRegStateMachine))
+        sm = HookedNetworkRegStateMachine(DeviceStub({}))
+        sm.calls = []
+        sm.transitionTo('registration_finished')
+        self.assertEqual(sm.mode, 'registration_finished')
+        self.assertEqual(sm.calls, ['exit check_registered',
+                                    'enter registration_finished'])
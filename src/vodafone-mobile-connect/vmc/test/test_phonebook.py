@@ -23,6 +23,7 @@ __version__ = "$Rev: 1172 $"
 
 import os
 
+from twisted.internet.defer import Deferred
 from twisted.trial.unittest import TestCase, SkipTest
 
 from vmc.common.hardware.hardwarereg import hw_reg
@@ -32,6 +33,7 @@ from vmc.common.statem.auth import AuthStateMachine
 from vmc.common.persistent import Contact
 from vmc.cli.collaborator import CLICollaboratorFactory
 from vmc.common.phonebook import get_phonebook
+from vmc.common import kdecontact
 
 
 PATH = '/tmp/settings.conf'
@@ -178,3 +180,78 @@ class TestPhoneBook(TestCase):
         return d
     
         
+
+
+VCARD = """BEGIN:VCARD
+VERSION:3.0
+FN:%s
+N:;%s;;;
+TEL;TYPE=CELL:%s
+END:VCARD
+"""
+
+class TestKDEContactsManager(TestCase):
+    """Tests for the KDE address book contacts manager"""
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.patch(kdecontact, '_KABC_PATH', self.path)
+        self.write_vcards([("Alice Smith", "+34600000001"),
+                           ("Bob Jones", "+34600000002"),
+                           ("Carol Smithson", "+34600000003")])
+        self.manager = kdecontact.KDEContactsManager()
+
+    def write_vcards(self, contacts, mtime=1000000000):
+        f = open(self.path, 'w')
+        for name, number in contacts:
+            f.write(VCARD % (name, name, number))
+        f.close()
+        os.utime(self.path, (mtime, mtime))
+
+    def names(self, contacts):
+        return sorted([c.get_name() for c in contacts])
+
+    def test_find_contacts_returns_deferred(self):
+        d = self.manager.find_contacts("alice")
+        self.failUnless(isinstance(d, Deferred))
+        d.addCallback(lambda contacts:
+                      self.assertEqual(self.names(contacts), ["Alice Smith"]))
+        return d
+
+    def test_find_contacts_matching(self):
+        def check(ignored, pattern, expected):
+            d = self.manager.find_contacts(pattern)
+            d.addCallback(lambda contacts:
+                          self.assertEqual(self.names(contacts), expected))
+            return d
+
+        d = check(None, "SMITH", ["Alice Smith", "Carol Smithson"])
+        d.addCallback(check, "on", ["Bob Jones", "Carol Smithson"])
+        # names are kept newline-separated, a match must not span two
+        d.addCallback(check, "jones\ncarol", [])
+        d.addCallback(check, "nobody", [])
+        d.addCallback(check, "", ["Alice Smith", "Bob Jones",
+                                  "Carol Smithson"])
+        return d
+
+    def test_find_contacts_without_address_book(self):
+        os.unlink(self.path)
+        d = self.manager.find_contacts("")
+        d.addCallback(self.assertEqual, [])
+        return d
+
+    def test_cache_reused_until_mtime_changes(self):
+        contacts = self.manager.get_contacts()
+        self.assertEqual(self.names(contacts),
+                         ["Alice Smith", "Bob Jones", "Carol Smithson"])
+        # unchanged file, the same parse is handed back
+        self.assertIdentical(self.manager.get_contacts(), contacts)
+
+        self.write_vcards([("Dave Smith", "+34600000004")],
+                          mtime=1000000060)
+        self.assertEqual(self.names(self.manager.get_contacts()),
+                         ["Dave Smith"])
+        d = self.manager.find_contacts("smith")
+        d.addCallback(lambda found:
+                      self.assertEqual(self.names(found), ["Dave Smith"]))
+        return d